@@ -0,0 +1,122 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+
+class AdaptiveLimiter:
+    """
+    Process-wide AIMD concurrency limiter.
+
+    At most `limit` calls run at once; other callers queue. Each successful call
+    grows the window by 1/limit (about +1 per full window), each throttled call
+    halves it and other failures leave it as is. Throttled calls and transient
+    errors (is_transient, e.g. 5xx or a dropped connection) are retried with
+    full-jitter exponential backoff.
+    Thread-safe, so callers on any thread or event-loop worker share one window.
+    """
+
+    def __init__(self, name, initial_limit=4, min_limit=1, max_limit=20,
+                 max_retries=5, base_delay=0.5, max_delay=20.0, is_throttle=None, is_transient=None):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.is_throttle = is_throttle or (lambda error: False)
+        self.is_transient = is_transient or (lambda error: False)
+
+        self._cond = threading.Condition()
+        self.inflight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self):
+        """Block until a slot in the window is free; returns the time spent queued"""
+        start = time.monotonic()
+        with self._cond:
+            self.waiting += 1
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.waiting -= 1
+            self.inflight += 1
+            waited = time.monotonic() - start
+            self.calls += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def release(self, throttled=False, succeeded=True):
+        """Free a slot and adapt the window; a call that failed without throttling leaves it unchanged"""
+        with self._cond:
+            self.inflight -= 1
+            if throttled:
+                self.throttles += 1
+                self.limit = max(self.min_limit, self.limit / 2)
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for the duration of a call"""
+        self.acquire()
+        throttled = False
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        except Exception as e:
+            throttled = self.is_throttle(e)
+            raise
+        finally:
+            self.release(throttled, succeeded)
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff delay for a retry attempt (0-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn within the window, retrying throttled and transient failures with jittered backoff"""
+        attempt = 0
+        while True:
+            try:
+                with self.slot():
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                throttled = self.is_throttle(e)
+                if not (throttled or self.is_transient(e)):
+                    raise
+                if attempt >= self.max_retries:
+                    with self._cond:
+                        self.failures += 1
+                    raise
+                delay = self.backoff(attempt)
+                attempt += 1
+                with self._cond:
+                    self.retries += 1
+                reason = "throttled" if throttled else f"failed ({type(e).__name__})"
+                print(f"⏳ {self.name} {reason}, retry {attempt}/{self.max_retries} in {delay:.2f}s (window {int(self.limit)})")
+                time.sleep(delay)
+
+    def stats(self):
+        """Window, queue and wait-time metrics"""
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "inflight": self.inflight,
+                "queued": self.waiting,
+                "calls": self.calls,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "failures": self.failures,
+                "avg_wait_seconds": self.total_wait / self.calls if self.calls else 0.0,
+                "max_wait_seconds": self.max_wait
+            }
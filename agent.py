@@ -1,225 +1,316 @@
-FUNCTION_DEFINITIONS = [
-        {
-            "name": "scrapeWebsiteWithPrompt",
-            "description": "Scrapes the given website URL using Firecrawl and extracts data guided by a custom prompt.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "url": { "type": "string", "description": "The URL of the website to scrape." },
-                    "prompt": { "type": "string", "description": "A natural language prompt instructing how to extract data." }
-                },
-                "required": ["url", "prompt"]
-            }
+import os
+import re
+import json
+import asyncio
+import threading
+import numpy as np
+from datetime import datetime
+
+from agentkit import make_crypto_actions
+from prompt_llms import prompt_nova_lite_async, prompt_nova_lite_stream_async, is_json_reply
+from google_search_api import google_search
+from google_services import create_google_meet_meeting, get_upcoming_meetings, send_email_with_token
+from youtube_apis import search_for_channels
+from firecrawl_search import scrapeWebsiteWithPrompt, scrapeYoutubeAboutPage
+from tool_registry import ToolSpec, tool_registry
+from candidate_scoring import score_candidate_pool, prefilter_candidates
+from candidate_store import CandidateStore
+from session_journal import SessionJournal, FileJournalStorage
+from campaign_store import campaign_store
+
+# Tool registry: every function the agent can call, with its timeout, retry policy,
+# result cache TTL, expected cost (USD), execution kind ("sync" tools run on a
+# thread pool) and whether cassettes replay its results. FUNCTION_DEFINITIONS is
+# generated from it and execute_function dispatches through it.
+
+tool_registry.register(ToolSpec(
+    name="scrapeWebsiteWithPrompt",
+    description="Scrapes the given website URL using Firecrawl and extracts data guided by a custom prompt.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "url": { "type": "string", "description": "The URL of the website to scrape." },
+            "prompt": { "type": "string", "description": "A natural language prompt instructing how to extract data." }
         },
-        {
-            "name": "scrapeYoutubeAboutPage",
-            "description": "Scrapes a YouTube channel's about page and extracts data using a predefined schema.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "url": { "type": "string", "description": "The URL of the YouTube about page to scrape." }
-                },
-                "required": ["url"]
-            }
+        "required": ["url", "prompt"]
+    },
+    handler=lambda agent, inputs: scrapeWebsiteWithPrompt(inputs["url"], inputs["prompt"]),
+    kind="async",
+    timeout=90,
+    retries=1,
+    cache_ttl=3600,
+    cost=0.005,
+    coalesce=True,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="scrapeYoutubeAboutPage",
+    description="Scrapes a YouTube channel's about page and extracts data using a predefined schema.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "url": { "type": "string", "description": "The URL of the YouTube about page to scrape." }
         },
-        {
-            "name": "google_search",
-            "description": "Performs a Google Custom Search for the given query and returns top search results.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": { "type": "string", "description": "The search query string." },
-                    "num_results": { "type": "integer", "description": "Number of results to return.", "default": 5 }
-                },
-                "required": ["query"]
-            }
+        "required": ["url"]
+    },
+    handler=lambda agent, inputs: scrapeYoutubeAboutPage(inputs["url"]),
+    kind="async",
+    timeout=90,
+    retries=1,
+    cache_ttl=3600,
+    cost=0.005,
+    coalesce=True,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="google_search",
+    description="Performs a Google Custom Search for the given query and returns top search results.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": { "type": "string", "description": "The search query string." },
+            "num_results": { "type": "integer", "description": "Number of results to return.", "default": 5 }
         },
-        {
-            "name": "search_for_channels",
-            "description": "Searches for channels on YouTube based on a query string.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": { "type": "string", "description": "The search query for channels." },
-                    "max_channels": { "type": "integer", "description": "Maximum number of channels to return.", "default": 10 }
-                },
-                "required": ["query"]
-            }
+        "required": ["query"]
+    },
+    handler=lambda agent, inputs: google_search(inputs["query"], inputs.get("num_results", 5)),
+    kind="sync",
+    timeout=20,
+    retries=2,
+    cache_ttl=3600,
+    cost=0.005,
+    coalesce=True,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="search_for_channels",
+    description="Searches for channels on YouTube based on a query string.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": { "type": "string", "description": "The search query for channels." },
+            "max_channels": { "type": "integer", "description": "Maximum number of channels to return.", "default": 10 }
         },
-        {
-            "name": "send_email_with_token",
-            "description": "Sends an email using the Gmail API and an OAuth2 access token. Optionally refreshes the token if refresh credentials are provided.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                "access_token": {
-                    "type": "string",
-                    "description": "OAuth2 access token from client."
-                },
-                "to_email": {
-                    "type": "string",
-                    "description": "Recipient's email address."
-                },
-                "subject": {
-                    "type": "string",
-                    "description": "Email subject."
-                },
-                "body_text": {
-                    "type": "string",
-                    "description": "Email body (plain text)."
-                },
-                "refresh_token": {
-                    "type": "string",
-                    "description": "OAuth2 refresh token (optional).",
-                },
-                "client_id": {
-                    "type": "string",
-                    "description": "OAuth2 client ID (optional).",
-                },
-                "client_secret": {
-                    "type": "string",
-                    "description": "OAuth2 client secret (optional).",
-                }
-                },
-                "required": [
-                "access_token",
-                "to_email",
-                "subject",
-                "body_text",
-                "refresh_token",
-                "client_id",
-                "client_secret"
-                ]
-            }
-            },
-        {
-            "name": "create_google_meet_meeting",
-            "description": "Creates a Google Meet meeting and returns the meeting details.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "access_token": { "type": "string", "description": "OAuth access token." },
-                    "title": { "type": "string", "description": "Title of the meeting." },
-                    "start_time": { "type": "string", "description": "Start time in ISO 8601 format." },
-                    "duration_minutes": { "type": "integer", "description": "Duration of the meeting in minutes.", "default": 60 },
-                    "description": { "type": "string", "description": "Description of the meeting.", "default": "" },
-                    "attendees": { "type": "array", "items": { "type": "string" }, "description": "List of attendee email addresses." },
-                    "timezone": { "type": "string", "description": "Time zone for the meeting.", "default": "UTC" },
-                    "refresh_token": { "type": "string", "description": "Optional refresh token for token renewal." },
-                    "client_id": { "type": "string", "description": "Optional client ID." },
-                    "client_secret": { "type": "string", "description": "Optional client secret." }
-                },
-                "required": ["access_token", "title", "start_time"]
-            }
+        "required": ["query"]
+    },
+    handler=lambda agent, inputs: search_for_channels(inputs["query"], inputs.get("max_channels", 10)),
+    kind="sync",
+    timeout=120,
+    cache_ttl=3600,
+    cost=0.001,
+    coalesce=True,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="send_email_with_token",
+    description="Sends an email using the Gmail API and an OAuth2 access token. Optionally refreshes the token if refresh credentials are provided.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "access_token": { "type": "string", "description": "OAuth2 access token from client." },
+            "to_email": { "type": "string", "description": "Recipient's email address." },
+            "subject": { "type": "string", "description": "Email subject." },
+            "body_text": { "type": "string", "description": "Email body (plain text)." },
+            "refresh_token": { "type": "string", "description": "OAuth2 refresh token (optional)." },
+            "client_id": { "type": "string", "description": "OAuth2 client ID (optional)." },
+            "client_secret": { "type": "string", "description": "OAuth2 client secret (optional)." }
         },
-        {
-            "name": "display_to_user",
-            "description": "Displays a message to the user without expecting any response. Use this for sharing information, updates, or results.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "message": { "type": "string", "description": "The message to display to the user." }
-                },
-                "required": ["message"]
-            }
+        "required": ["access_token", "to_email", "subject", "body_text", "refresh_token", "client_id", "client_secret"]
+    },
+    handler=lambda agent, inputs: agent.send_email_and_track_thread(inputs),
+    kind="sync",
+    timeout=30,
+    idempotent=False,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="create_google_meet_meeting",
+    description="Creates a Google Meet meeting and returns the meeting details.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "access_token": { "type": "string", "description": "OAuth access token." },
+            "title": { "type": "string", "description": "Title of the meeting." },
+            "start_time": { "type": "string", "description": "Start time in ISO 8601 format." },
+            "duration_minutes": { "type": "integer", "description": "Duration of the meeting in minutes.", "default": 60 },
+            "description": { "type": "string", "description": "Description of the meeting.", "default": "" },
+            "attendees": { "type": "array", "items": { "type": "string" }, "description": "List of attendee email addresses." },
+            "timezone": { "type": "string", "description": "Time zone for the meeting.", "default": "UTC" },
+            "refresh_token": { "type": "string", "description": "Optional refresh token for token renewal." },
+            "client_id": { "type": "string", "description": "Optional client ID." },
+            "client_secret": { "type": "string", "description": "Optional client secret." }
         },
-        {
-            "name": "display_to_user_and_wait_for_input",
-            "description": "Displays a message to the user and waits for their input to continue. Use this when you need user interaction to proceed.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "message": { "type": "string", "description": "The message to display to the user before waiting for input." },
-                    "prompt": { "type": "string", "description": "Optional prompt text to guide user input.", "default": "Please provide your response:" }
-                },
-                "required": ["message"]
-            }
+        "required": ["access_token", "title", "start_time"]
+    },
+    handler=lambda agent, inputs: create_google_meet_meeting(**inputs),
+    kind="sync",
+    timeout=30,
+    idempotent=False,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="get_upcoming_meetings",
+    description="Gets upcoming meetings from Google Calendar.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "access_token": { "type": "string", "description": "OAuth access token." },
+            "max_results": { "type": "integer", "description": "Maximum number of events to return.", "default": 10 },
+            "refresh_token": { "type": "string", "description": "Optional refresh token for token renewal." },
+            "client_id": { "type": "string", "description": "Optional client ID." },
+            "client_secret": { "type": "string", "description": "Optional client secret." }
         },
-        {
-            "name": "score_candidates",
-            "description": "Scores and ranks a list of candidates based on user preferences and query relevance using AI analysis.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "candidates": {
-                        "type": "array",
-                        "description": "List of candidate objects to score."
-                    },
-                    "user_query": {
-                        "type": "string",
-                        "description": "The original user query describing what they're looking for."
-                    },
-                    "user_preferences": {
-                        "type": "object",
-                        "description": "User preferences including budget, location, experience level, etc."
-                    }
-                },
-                "required": ["candidates", "user_query"]
-            }
+        "required": ["access_token"]
+    },
+    handler=lambda agent, inputs: get_upcoming_meetings(**inputs),
+    kind="sync",
+    timeout=30,
+    retries=1,
+    listed=False,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="display_to_user",
+    description="Displays a message to the user without expecting any response. Use this for sharing information, updates, or results.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "message": { "type": "string", "description": "The message to display to the user." }
         },
-        {
-            "name": "prepare_outreach",
-            "description": "Prepares personalized outreach messages for scored candidates using AI to generate compelling, customized emails.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "candidates": {
-                        "type": "array",
-                        "description": "List of scored candidate objects to prepare outreach for."
-                    },
-                    "user_query": {
-                        "type": "string",
-                        "description": "The original user query describing what they're looking for."
-                    },
-                    "user_preferences": {
-                        "type": "object",
-                        "description": "User preferences including budget, company info, etc."
-                    },
-                    "sender_info": {
-                        "type": "object",
-                        "description": "Sender information including name, company, email, etc."
-                    }
-                },
-                "required": ["candidates", "user_query"]
-            }
+        "required": ["message"]
+    },
+    handler=lambda agent, inputs: agent.display_message(inputs),
+    kind="inline",
+    timeout=None
+))
+
+tool_registry.register(ToolSpec(
+    name="display_to_user_and_wait_for_input",
+    description="Displays a message to the user and waits for their input to continue. Use this when you need user interaction to proceed.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "message": { "type": "string", "description": "The message to display to the user before waiting for input." },
+            "prompt": { "type": "string", "description": "Optional prompt text to guide user input.", "default": "Please provide your response:" }
         },
-        {
-            "name": "fetch_credentials",
-            "description": "Fetches OAuth credentials from a file.",
-            "parameters": {
-                "type": "object",
-                "properties": {},
-                "required": []
-            }
+        "required": ["message"]
+    },
+    handler=lambda agent, inputs: agent.request_user_input(inputs),
+    kind="inline",
+    timeout=None
+))
+
+tool_registry.register(ToolSpec(
+    name="score_candidates",
+    description="Scores and ranks stored candidates based on user preferences and query relevance using AI analysis. Reference candidates by ID or selector; never copy candidate objects into the inputs.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "candidate_ids": { "type": "array", "items": { "type": "string" }, "description": "IDs of the candidates to score, e.g. [\"c1\", \"c4\"]." },
+            "selector": { "type": "object", "description": "Alternative to candidate_ids: {\"source\": \"all\" | \"scored\" | \"search\", \"search_id\": \"s2\", \"top\": 10}. Defaults to all candidates." },
+            "user_query": { "type": "string", "description": "The original user query describing what they're looking for." },
+            "user_preferences": { "type": "object", "description": "User preferences including budget, location, experience level, etc." }
         },
-        {
-            "name": "make_crypto_actions",
-            "description": "Executes various crypto actions using the Coinbase AgentKit, such as receiving wallet details, checking balances, and transferring tokens(native or ERC20 tokens). You'll be using only two ERC-20 tokens here: USDC or EURC, nothing else. ",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "prompt": { "type": "string", "description": "The prompt describing the crypto action to perform in Natural Language." }
-                },
-                "required": ["prompt"]
-            }
+        "required": ["user_query"]
+    },
+    handler=lambda agent, inputs: agent.score_candidates_with_llm(
+        agent.resolve_candidates(inputs, default_source="all"),
+        inputs.get("user_query") or agent.state.get("raw_user_query", ""),
+        inputs.get("user_preferences", {})
+    ),
+    kind="async",
+    timeout=300,
+    cost=0.002
+))
+
+tool_registry.register(ToolSpec(
+    name="prepare_outreach",
+    description="Prepares personalized outreach messages for scored candidates using AI to generate compelling, customized emails. Reference candidates by ID or selector; never copy candidate objects into the inputs.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "candidate_ids": { "type": "array", "items": { "type": "string" }, "description": "IDs of the candidates to prepare outreach for, e.g. [\"c1\", \"c4\"]." },
+            "selector": { "type": "object", "description": "Alternative to candidate_ids: {\"source\": \"all\" | \"scored\" | \"search\", \"search_id\": \"s2\", \"top\": 10}. Defaults to the scored candidates." },
+            "user_query": { "type": "string", "description": "The original user query describing what they're looking for." },
+            "user_preferences": { "type": "object", "description": "User preferences including budget, company info, etc." },
+            "sender_info": { "type": "object", "description": "Sender information including name, company, email, etc." }
         },
-        {
-            "name": "update_available_budget",
-            "description": "Updates the available budget left for outreach.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "new_budget": { "type": "number", "description": "The new budget amount left." }
-                },
-                "required": ["new_budget"]
-            }
-        }
-    ]
+        "required": ["user_query"]
+    },
+    handler=lambda agent, inputs: agent.prepare_outreach_with_llm(
+        agent.resolve_candidates(inputs, default_source="scored"),
+        inputs.get("user_query") or agent.state.get("raw_user_query", ""),
+        inputs.get("user_preferences", {}),
+        inputs.get("sender_info", {})
+    ),
+    kind="async",
+    timeout=600,
+    cost=0.01
+))
+
+tool_registry.register(ToolSpec(
+    name="fetch_credentials",
+    description="Fetches OAuth credentials from a file.",
+    parameters={
+        "type": "object",
+        "properties": {},
+        "required": []
+    },
+    handler=lambda agent, inputs: fetch_credentials(agent.session_id),
+    kind="inline",
+    timeout=None,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="make_crypto_actions",
+    description="Executes various crypto actions using the Coinbase AgentKit, such as receiving wallet details, checking balances, and transferring tokens(native or ERC20 tokens). You'll be using only two ERC-20 tokens here: USDC or EURC, nothing else. ",
+    parameters={
+        "type": "object",
+        "properties": {
+            "prompt": { "type": "string", "description": "The prompt describing the crypto action to perform in Natural Language." }
+        },
+        "required": ["prompt"]
+    },
+    handler=lambda agent, inputs: make_crypto_actions(inputs["prompt"]),
+    kind="sync",
+    timeout=120,
+    idempotent=False,
+    replayable=True
+))
+
+tool_registry.register(ToolSpec(
+    name="update_available_budget",
+    description="Updates the available budget left for outreach.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "new_budget": { "type": "number", "description": "The new budget amount left." }
+        },
+        "required": ["new_budget"]
+    },
+    handler=lambda agent, inputs: agent.update_available_budget(inputs.get("new_budget")),
+    kind="inline",
+    timeout=None
+))
+
+FUNCTION_DEFINITIONS = tool_registry.function_definitions()
+
+# Canonical compact JSON of the tool catalog, built once so the system prompt is byte-identical
+# across steps and sessions and can be served from Bedrock's prompt cache
+TOOL_CATALOG_JSON = json.dumps(FUNCTION_DEFINITIONS, separators=(",", ":"), sort_keys=True)
 
 INITIAL_PROMPT = f'''
 You are a highly autonomous outreach agent. Your primary goal is to find and connect with the right people for various purposes (e.g., podcast guests, influencers, co-founders) with minimal user intervention. You will automate the entire process from search to outreach.
 
-Here are the functions you can use: {FUNCTION_DEFINITIONS}
+Here are the functions you can use: {TOOL_CATALOG_JSON}
 
 You must always reply in a JSON format with the following structure:
 {{
@@ -240,6 +331,8 @@ You must always reply in a JSON format with the following structure:
 4.  **Proactive Execution:** Use all available tools to gather a comprehensive list of candidates. Score them, prepare outreach messages, and present the results.
 5.  **Clarify When Necessary:** If you need to clarify something, please ask the user, don't email or message anyone without having the mail reviewed by the user.
 
+When several calls are independent of each other (e.g. multiple searches or scrapes), return "function_calls" as a list of such objects instead; they will run in parallel and all results come back together. Never batch `display_to_user_and_wait_for_input` with calls whose results you still need to see.
+Search results are stored server-side as candidates with IDs ("c1", "c2", ...) under a search ID ("s1", ...). Refer to candidates by `candidate_ids` or a `selector` instead of repeating their details.
 If there is no function call, return an empty dict for "function_calls".
 Your goal is maximum automation and minimal human intervention.
 
@@ -248,18 +341,6 @@ IN CASE YOU NEED IT, THE CONTRACT ADDRESS OF USDC IS `0x036CbD53842c5426634e7929
 SEE EVERY FUNCTION CALL U MAKE COSTS MONEY, COZ WE ARE USING AN API FOR IT, MINIMISE IT
 '''
 
-import asyncio
-import json
-import json
-import asyncio
-
-from agentkit import make_crypto_actions
-from prompt_llms import prompt_nova_lite
-from google_search_api import google_search
-from google_services import create_google_meet_meeting, get_upcoming_meetings, send_email_with_token
-from youtube_apis import search_for_channels
-from firecrawl_search import scrapeWebsiteWithPrompt, scrapeYoutubeAboutPage
-
 def to_json(json_string):
     try:
         first_curly_index = json_string.find("{")
@@ -271,6 +352,252 @@ def to_json(json_string):
         print("Error parsing JSON!!")
 
 
+class ThoughtStreamExtractor:
+    """
+    Incrementally extracts the "thought" string from a streamed JSON reply.
+
+    feed() takes the next chunk of raw reply text and returns the newly
+    decoded part of the thought value (empty string if nothing new yet).
+    """
+
+    def __init__(self, field="thought"):
+        self.field = field
+        self.buffer = ""
+        self.emitted = 0
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.done:
+            return ""
+
+        match = re.search(r'"%s"\s*:\s*"' % re.escape(self.field), self.buffer)
+        if not match:
+            return ""
+
+        raw = self.buffer[match.end():]
+        end = 0
+        while end < len(raw):
+            char = raw[end]
+            if char == "\\":
+                if end + 1 >= len(raw):
+                    break
+                if raw[end + 1] == "u" and end + 6 > len(raw):
+                    break
+                # A high surrogate escape waits for its low half, so the pair decodes to one character
+                if raw[end + 1] == "u" and raw[end + 2:end + 4].lower() in ("d8", "d9", "da", "db") \
+                        and end + 12 > len(raw):
+                    break
+                end += 6 if raw[end + 1] == "u" else 2
+                continue
+            if char == '"':
+                self.done = True
+                break
+            end += 1
+
+        try:
+            decoded = json.loads(f'"{raw[:end]}"')
+        except json.JSONDecodeError:
+            return ""
+
+        delta = decoded[self.emitted:]
+        self.emitted = len(decoded)
+        return delta
+
+
+# Max tool calls from one LLM turn that run at the same time
+TOOL_CONCURRENCY = int(os.getenv("AGENT_TOOL_CONCURRENCY", "4"))
+
+# Functions that hand control back to the user; they run after the rest of a batch
+INPUT_FUNCTIONS = {"display_to_user_and_wait_for_input"}
+
+# Steps one run of events() may take before it reports completion
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "10"))
+
+# Process-wide step counters: every planned call should execute exactly once
+_step_stats = {"steps": 0, "calls": 0, "executions": 0}
+_step_stats_lock = threading.Lock()
+
+async def run_blocking(fn, *args):
+    """Run a blocking call (a SQLite commit, numpy scoring) in a worker thread so the shared event loop keeps serving other sessions"""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+def agent_step_stats():
+    """Steps taken, function calls planned and executed across all agents"""
+    with _step_stats_lock:
+        stats = dict(_step_stats)
+    stats["executions_per_call"] = stats["executions"] / stats["calls"] if stats["calls"] else 0.0
+    return stats
+
+def agent_event(event_type, content, session_id=None, **fields):
+    """One typed agent event: {"type", "content", "timestamp", "session_id"} plus event-specific fields"""
+    event = {"type": event_type, "content": content, "timestamp": datetime.now().isoformat(), "session_id": session_id}
+    event.update(fields)
+    return event
+
+def normalize_function_calls(function_calls):
+    """Return the LLM's "function_calls" value (a single call or a list of calls) as a list of calls"""
+    if isinstance(function_calls, dict):
+        function_calls = [function_calls]
+    if not isinstance(function_calls, list):
+        return []
+    return [
+        {"name": call["name"], "inputs": call.get("inputs") or {}}
+        for call in function_calls
+        if isinstance(call, dict) and call.get("name")
+    ]
+
+
+# Sharded candidate scoring: batch size and token bound, concurrent batches, and
+# how many of the best candidates get a head-to-head re-rank (0 disables it)
+SCORING_SHARD_SIZE = int(os.getenv("SCORING_SHARD_SIZE", "20"))
+SCORING_SHARD_TOKEN_BUDGET = int(os.getenv("SCORING_SHARD_TOKEN_BUDGET", "6000"))
+SCORING_CONCURRENCY = int(os.getenv("SCORING_CONCURRENCY", "4"))
+SCORING_RERANK_TOP_K = int(os.getenv("SCORING_RERANK_TOP_K", "10"))
+
+# Offline pre-filter in front of LLM scoring: pools larger than PREFILTER_TOP_K are cut
+# to the K candidates most similar to the query (0 disables). PREFILTER_AUDIT_SAMPLE
+# dropped candidates are scored anyway to estimate the pre-filter's recall.
+PREFILTER_TOP_K = int(os.getenv("PREFILTER_TOP_K", "60"))
+PREFILTER_MIN_SIMILARITY = float(os.getenv("PREFILTER_MIN_SIMILARITY", "0.05"))
+PREFILTER_AUDIT_SAMPLE = int(os.getenv("PREFILTER_AUDIT_SAMPLE", "5"))
+
+def calibrate_shard_scores(shard_scores):
+    """
+    Put scores from separately scored batches on a common scale.
+
+    Each batch's scores are standardized and blended 50/50 with the raw score, so a
+    batch the LLM scored harshly or generously does not dominate the global ranking
+    while real quality differences between batches still count. The original score
+    is kept as ai_raw_score.
+    """
+    for scored in shard_scores:
+        raw = [float(candidate.get("ai_score", 0) or 0) for candidate in scored]
+        if len(raw) < 3:
+            continue
+        mean = sum(raw) / len(raw)
+        std = (sum((score - mean) ** 2 for score in raw) / len(raw)) ** 0.5
+        if std == 0:
+            continue
+        for candidate, score in zip(scored, raw):
+            standardized = min(100.0, max(0.0, 50 + 15 * (score - mean) / std))
+            candidate["ai_raw_score"] = candidate.get("ai_score", 0)
+            candidate["ai_score"] = round(0.5 * score + 0.5 * standardized, 1)
+
+
+def scoring_method(num_shards, failed_shards):
+    """Method reported for an LLM scoring run, given how many of its batches fell back to basic scoring"""
+    if failed_shards == num_shards:
+        return "basic_fallback"
+    if failed_shards:
+        return "llm_mixed"
+    return "llm_sharded" if num_shards > 1 else "llm_based"
+
+
+# Outreach emails drafted at the same time
+OUTREACH_CONCURRENCY = int(os.getenv("OUTREACH_CONCURRENCY", "5"))
+
+# Token ceiling for the conversation history sent to the LLM on each turn
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "12000"))
+# Most recent turns that are always sent verbatim
+HISTORY_KEEP_RECENT_TURNS = int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "6"))
+# Older turns are cut down to this many characters before being dropped entirely
+HISTORY_COMPACT_CHARS = int(os.getenv("HISTORY_COMPACT_CHARS", "400"))
+
+def estimate_tokens(value):
+    """Rough token estimate (~4 characters per token) for strings or JSON-serializable values"""
+    if not isinstance(value, str):
+        value = json.dumps(value, separators=(",", ":"), default=str)
+    return len(value) // 4 + 1
+
+def compact_turn(turn, max_chars=HISTORY_COMPACT_CHARS):
+    """Shorten a history turn's content, keeping its role and other fields"""
+    content = turn.get("content")
+    if not isinstance(content, str):
+        content = json.dumps(content, separators=(",", ":"), default=str)
+    if len(content) > max_chars:
+        content = f"{content[:max_chars]}... [truncated {len(content) - max_chars} chars]"
+    return {**turn, "content": content}
+
+def build_history_window(history, token_budget=HISTORY_TOKEN_BUDGET, keep_recent=HISTORY_KEEP_RECENT_TURNS):
+    """
+    Select the conversation history to send to the LLM within a token budget.
+
+    System turns are always kept and the latest `keep_recent` turns are kept verbatim.
+    Older turns are compacted, newest first, while the budget allows and dropped after that.
+
+    Returns:
+        Tuple of (history window, stats dict)
+    """
+    pinned = [turn for turn in history if turn.get("role") == "system"]
+    others = [turn for turn in history if turn.get("role") != "system"]
+    recent = others[-keep_recent:] if keep_recent > 0 else []
+    older = others[:len(others) - len(recent)]
+
+    used = sum(estimate_tokens(turn) for turn in pinned + recent)
+    kept_older = []
+    compacted = 0
+    for turn in reversed(older):
+        if used >= token_budget:
+            break
+        candidate = turn
+        cost = estimate_tokens(turn)
+        if used + cost > token_budget:
+            candidate = compact_turn(turn)
+            cost = estimate_tokens(candidate)
+            if used + cost > token_budget:
+                break
+            compacted += 1
+        kept_older.append(candidate)
+        used += cost
+    kept_older.reverse()
+
+    window = pinned + kept_older + recent
+    full_tokens = sum(estimate_tokens(turn) for turn in history)
+    return window, {
+        "full_tokens": full_tokens,
+        "window_tokens": used,
+        "tokens_saved": max(full_tokens - used, 0),
+        "turns_compacted": compacted,
+        "turns_dropped": len(older) - len(kept_older)
+    }
+
+def history_to_messages(history):
+    """
+    Convert conversation history turns into (system prompt, Bedrock messages).
+
+    System turns become the system block, tool results become compact user text
+    blocks, and consecutive turns from the same role are merged so the messages
+    alternate user/assistant and end on a user turn as Bedrock requires.
+    """
+    system_parts = []
+    messages = []
+    for turn in history:
+        role = turn.get("role")
+        content = turn.get("content")
+        if content is None:
+            continue
+        text = content if isinstance(content, str) else json.dumps(content, separators=(",", ":"), default=str)
+        if role == "system":
+            system_parts.append(text)
+            continue
+        if role == "tool":
+            role = "user"
+            text = f"[{turn.get('name', 'tool')} result] {text}"
+        if not text:
+            continue
+        if messages and messages[-1]["role"] == role:
+            messages[-1]["content"].append({"text": text})
+        else:
+            messages.append({"role": role, "content": [{"text": text}]})
+
+    if messages and messages[0]["role"] != "user":
+        messages.insert(0, {"role": "user", "content": [{"text": "(Earlier conversation omitted.)"}]})
+    if not messages or messages[-1]["role"] != "user":
+        messages.append({"role": "user", "content": [{"text": "Continue."}]})
+    return "\n\n".join(system_parts), messages
+
+
 # Global handlers for display and input - can be overridden for web interface
 _display_handler = None
 _input_handler = None
@@ -305,25 +632,55 @@ def display_to_user_and_wait_for_input(message, prompt="Please provide your resp
         user_response = input(f"{prompt} ").strip()
         return user_response
 
+def to_candidate(function_name, result):
+    """Normalize one search result into a candidate dict"""
+    if isinstance(result, dict):
+        candidate = dict(result)
+    elif isinstance(result, (list, tuple)) and len(result) == 3:
+        # google_search returns (title, snippet, link) tuples
+        title, snippet, link = result
+        candidate = {"name": title, "description": snippet, "url": link}
+    else:
+        candidate = {"description": str(result)}
+    candidate.setdefault("source", function_name)
+    return candidate
+
+def parse_candidate_selector(selector):
+    """Accept selector objects or short strings like "top 10 scored" / "all from search s2" """
+    if isinstance(selector, dict):
+        return selector
+    text = str(selector).lower()
+    parsed = {"source": "all"}
+    search = re.search(r"search\s+(s\d+)", text)
+    if search:
+        parsed = {"source": "search", "search_id": search.group(1)}
+    elif "scored" in text:
+        parsed = {"source": "scored"}
+    top = re.search(r"top\s+(\d+)", text)
+    if top:
+        parsed["top"] = int(top.group(1))
+    return parsed
+
 def fetch_credentials(session_id):
-    try:
-        with open(f"creds/creds_{session_id}.json", "r") as f:
-            json_data = json.load(f)
-        return json_data["credentials"]
-    except FileNotFoundError:
-        return ["No credentials file found"]
-    except json.JSONDecodeError as e:
-        print(f"Error parsing credentials JSON: {e}")
-        return ["Invalid credentials file format"]
-    except Exception as e:
-        print(f"Error reading credentials: {e}")
-        return ["Error reading credentials file"]
+    credentials = campaign_store.get_credentials(session_id)
+    if credentials is None:
+        return ["No credentials found for this session"]
+    return credentials
 
 
 class AutonomousOutreachAgent:
     def __init__(self, session_id=None):
         self.session_id = session_id
+        self.store_id = session_id or "default"  # Key of this session in the campaign store
         self.streaming_agent = None  # Will be set by Flask app
+        self.last_context_stats = None  # Token accounting for the most recent LLM turn
+        self._candidate_store = None
+        self._journal = None
+        self._event_sink = None  # Set while events() runs; receives events from the agent and its tools
+        self.steps_taken = 0
+        self._modified_items = {}  # state key -> {index: item} changed in place since the last save
+        self._dirty_keys = set()  # state keys replaced or changed otherwise since the last save
+        self.state_loaded = False  # Saving before load_state() would overwrite the stored state with defaults
         self.state = {
             "raw_user_query": "",
             "search_criteria": {},
@@ -336,6 +693,9 @@ class AutonomousOutreachAgent:
             "budget_left": 0,
             "errors": [],
             "conversation_history": [],
+            "searches": {},  # search_id -> {"function", "query", "candidate_ids"}
+            "next_candidate_id": 1,
+            "candidate_stats": {},  # dedup counters of the candidate store
         }
 
         self.state["conversation_history"] = [
@@ -349,101 +709,263 @@ class AutonomousOutreachAgent:
         """Set the streaming agent for web interface"""
         self.streaming_agent = streaming_agent
         
+    def state_path(self):
+        return f"agent_state/agent_state_{self.session_id}.json" if self.session_id else "agent_state/agent_state.json"
+
+    @property
+    def journal(self):
+        """Append-only journal persisting this session's state in the campaign store"""
+        if self._journal is None:
+            self._journal = SessionJournal(campaign_store.journal_storage(self.store_id))
+        return self._journal
+
     def save_state(self, filename=None):
-        """Save current state to file"""
-        if filename is None:
-            filename = f"agent_state/agent_state_{self.session_id}.json" if self.session_id else "agent_state/agent_state.json"
-        with open(filename, 'w') as f:
-            json.dump(self.state, f, indent=2)
-    
+        """
+        Persist state changes since the last save.
+
+        Appends only the mutations to the session journal, so the cost does not grow
+        with the conversation. An explicit filename writes a full standalone copy instead.
+        """
+        if filename is not None:
+            with open(filename, 'w') as f:
+                json.dump(self.state, f, indent=2)
+            return
+        self.journal.save(self.state, *self._take_changes())
+
+    async def save_state_async(self):
+        """save_state() for coroutines: the journal append runs in a worker thread, off the event loop"""
+        await run_blocking(self.journal.save, self.state, *self._take_changes())
+
+    def _take_changes(self):
+        """In-place item updates and dirty keys recorded since the last save, for the journal"""
+        modified, self._modified_items = self._modified_items, {}
+        dirty, self._dirty_keys = self._dirty_keys, set()
+        return modified, dirty
+
+    def compact_state(self):
+        """Fold the session journal into a fresh snapshot"""
+        self.save_state()
+        self.journal.snapshot(self.state)
+
     def load_state(self, filename=None):
-        """Load state from file"""
-        if filename is None:
-            filename = f"agent_state/agent_state_{self.session_id}.json" if self.session_id else "agent_state/agent_state.json"
-        try:
-            with open(filename, 'r') as f:
-                self.state = json.load(f)
-        except FileNotFoundError:
+        """Load state from the session snapshot and journal (or from a standalone file)"""
+        self.state_loaded = True
+        if filename is not None:
+            try:
+                with open(filename, 'r') as f:
+                    self.state = json.load(f)
+            except FileNotFoundError:
+                print(f"No previous state found at {filename}, starting fresh.")
+            return
+        state = self.journal.load()
+        if state is None:
+            # Sessions saved by older versions live in agent_state/ files
+            legacy = FileJournalStorage(self.state_path())
+            if legacy.exists():
+                state = SessionJournal(legacy).load()
+                self.state = state
+                self.journal.snapshot(state)
+                print(f"📦 Imported state of session {self.session_id} from {self.state_path()}")
+                return
             print(f"No previous state found for session {self.session_id}, starting fresh.")
+        else:
+            self.state = state
     
+    @property
+    def candidate_store(self):
+        """Dedup index over state["candidates"], rebuilt whenever the state is replaced"""
+        candidates = self.state.setdefault("candidates", [])
+        if self._candidate_store is None or self._candidate_store.candidates is not candidates:
+            self._candidate_store = CandidateStore(candidates, self.state.setdefault("candidate_stats", {}))
+        return self._candidate_store
+
+    def add_candidates(self, function_name, inputs, results):
+        """
+        Store search results as candidates under stable IDs.
+
+        Results already seen in an earlier search (same channel, URL or email) are
+        merged into the existing candidate instead of being added again. The caller
+        writes the returned candidates to the campaign store.
+
+        Returns the result to show the LLM: the search ID and the candidates tagged with their IDs.
+        """
+        searches = self.state.setdefault("searches", {})
+        search_id = f"s{len(searches) + 1}"
+        tagged = {}
+        merged = 0
+        for result in results:
+            candidate = to_candidate(function_name, result)
+            candidate["search_id"] = search_id
+            next_id = self.state.get("next_candidate_id", len(self.state["candidates"]) + 1)
+            stored, was_merged = self.candidate_store.add(candidate, f"c{next_id}")
+            if was_merged:
+                merged += 1
+                position = self.candidate_store.position(stored["candidate_id"])
+                self._modified_items.setdefault("candidates", {})[position] = stored
+            else:
+                self.state["next_candidate_id"] = next_id + 1
+                self._dirty_keys.add("next_candidate_id")
+            tagged[stored["candidate_id"]] = stored
+        if merged:
+            print(f"🔁 Merged {merged} duplicate candidates from {function_name}")
+        searches[search_id] = {
+            "function": function_name,
+            "query": inputs.get("query"),
+            "candidate_ids": list(tagged)
+        }
+        self._modified_items.setdefault("searches", {})[search_id] = searches[search_id]
+        self._dirty_keys.add("candidate_stats")
+        return {"search_id": search_id, "candidates": list(tagged.values())}
+
+    def resolve_candidates(self, inputs, default_source="all"):
+        """
+        Resolve candidate handles from tool inputs to the stored candidate objects.
+
+        Accepts `candidate_ids`, a `selector`, or (for older prompts) full `candidates`
+        objects. Scored versions are preferred so outreach sees AI scores and strengths.
+        """
+        by_id = {c["candidate_id"]: c for c in self.state.get("candidates", []) if "candidate_id" in c}
+        by_id.update({c["candidate_id"]: c for c in self.state.get("scored_candidates", []) if "candidate_id" in c})
+
+        if inputs.get("candidate_ids"):
+            return [by_id[candidate_id] for candidate_id in inputs["candidate_ids"] if candidate_id in by_id]
+
+        if inputs.get("candidates"):
+            return [
+                by_id.get(candidate.get("candidate_id"), candidate) if isinstance(candidate, dict) else by_id.get(candidate, candidate)
+                for candidate in inputs["candidates"]
+            ]
+
+        selector = parse_candidate_selector(inputs.get("selector") or {"source": default_source})
+        source = selector.get("source", "all")
+        if source == "scored":
+            pool = list(self.state.get("scored_candidates", []))
+        elif source == "search":
+            search = self.state.get("searches", {}).get(selector.get("search_id"), {})
+            pool = [by_id[candidate_id] for candidate_id in search.get("candidate_ids", []) if candidate_id in by_id]
+        else:
+            pool = [by_id.get(c.get("candidate_id"), c) for c in self.state.get("candidates", [])]
+
+        if selector.get("top"):
+            pool = pool[:int(selector["top"])]
+        return pool
+
+    def emit(self, event_type, content, **fields):
+        """Send an event to the run consuming events(); does nothing outside a run"""
+        sink = self._event_sink
+        if sink:
+            sink(agent_event(event_type, content, self.session_id, **fields))
+
+    def display_message(self, inputs):
+        """Handler for display_to_user"""
+        if self._event_sink:
+            self.emit("tool_progress", inputs["message"], kind="display_message")
+        else:
+            display_to_user(inputs["message"])
+        return "Message displayed"
+
+    def request_user_input(self, inputs):
+        """Handler for display_to_user_and_wait_for_input"""
+        message = inputs.get("message", "")
+        prompt = inputs.get("prompt", "Please provide your response:")
+        if self.streaming_agent or _input_handler:
+            # We're in a streaming (or scripted) context - trigger the input request;
+            # the input handler will handle the waiting state
+            return display_to_user_and_wait_for_input(message, prompt, self.session_id)
+        # Non-streaming context - use regular input
+        return display_to_user_and_wait_for_input(message, prompt)
+
+    def send_email_and_track_thread(self, inputs):
+        """Handler for send_email_with_token; records the sent thread for follow-up matching"""
+        response = send_email_with_token(**inputs)
+        if response.get("status") == "sent":
+            thread_id = response.get("thread_id")
+            campaign_store.record_sent_thread(self.store_id, thread_id, inputs.get("to_email"), inputs.get("subject"))
+
+        return response
+
     async def execute_function(self, function_name, inputs):
-        """Execute a function call and return the result"""
+        """Execute a function call through the tool registry and return the result"""
+        if tool_registry.get(function_name) is None:
+            return f"Unknown function: {function_name}"
         try:
-            if function_name == "display_to_user_and_wait_for_input":
-                # For streaming interface, we need to wait for user input
-                message = inputs.get("message", "")
-                prompt = inputs.get("prompt", "Please provide your response:")
-                if self.streaming_agent:
-                    # We're in a streaming context - trigger the input request
-                    result = display_to_user_and_wait_for_input(message, prompt, self.session_id)
-                    # The streaming agent will handle the waiting state
-                    return result
-                else:
-                    # Non-streaming context - use regular input
-                    return display_to_user_and_wait_for_input(message, prompt)
-            elif function_name == "display_to_user":
-                display_to_user(inputs["message"])
-                return "Message displayed"
-            elif function_name == "google_search":
-                return google_search(inputs["query"], inputs.get("num_results", 5))
-            elif function_name == "search_for_channels":
-                return search_for_channels(inputs["query"], inputs.get("max_channels", 10))
-            elif function_name == "scrapeWebsiteWithPrompt":
-                return await scrapeWebsiteWithPrompt(inputs["url"], inputs["prompt"])
-            elif function_name == "scrapeYoutubeAboutPage":
-                return await scrapeYoutubeAboutPage(inputs["url"])
-            elif function_name == "send_email_with_token":
-                response = send_email_with_token(**inputs)
-                if response.get("status") == "sent":
-                    thread_id = response.get("thread_id")
-                    
-                    # Read, modify, and write back the credentials file
-                    creds_file_path = f"creds/creds_{self.session_id}.json"
-                    try:
-                        with open(creds_file_path, "r") as f:
-                            json_data = json.load(f)
-                        
-                        if "thread_ids_sent" not in json_data:
-                            json_data["thread_ids_sent"] = []
-                        json_data["thread_ids_sent"].append(thread_id)
-                        
-                        with open(creds_file_path, "w") as f:
-                            f.write(json.dumps(json_data, indent=2))
-                    except Exception as e:
-                        print(f"Error updating credentials file: {e}")
-
-                return response
-            elif function_name == "create_google_meet_meeting":
-                return create_google_meet_meeting(**inputs)
-            elif function_name == "get_upcoming_meetings":
-                return get_upcoming_meetings(**inputs)
-            elif function_name == "score_candidates":
-                return await self.score_candidates_with_llm(
-                    inputs["candidates"], 
-                    inputs["user_query"], 
-                    inputs.get("user_preferences", {})
-                )
-            elif function_name == "prepare_outreach":
-                return await self.prepare_outreach_with_llm(
-                    inputs["candidates"],
-                    inputs["user_query"],
-                    inputs.get("user_preferences", {}),
-                    inputs.get("sender_info", {})
-                )
-            elif function_name == "fetch_credentials":
-                return fetch_credentials(self.session_id)
-            elif function_name == "make_crypto_actions":
-                return make_crypto_actions(inputs["prompt"])
-            elif function_name == "update_available_budget":
-                return self.update_available_budget(inputs.get("new_budget"))
-            else:
-                return f"Unknown function: {function_name}"
+            return await tool_registry.dispatch(function_name, self, inputs)
         except Exception as e:
             error_details = f"Error executing {function_name}: {str(e)}"
             self.state["errors"].append(error_details)
-            self.save_state()
+            await self.save_state_async()
             return error_details
     
+    async def execute_function_calls(self, function_calls):
+        """
+        Execute a turn's function calls concurrently (at most TOOL_CONCURRENCY at once).
+
+        Calls that wait for user input run last, after the rest of the batch.
+        Each call records how many times it ran in call["executions"]. Results are
+        folded into the state in call order, each as soon as it and the calls before
+        it are done, with a tool_start and tool_result event per call.
+        Returns the results in the same order as the calls.
+        """
+        semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)
+        with _step_stats_lock:
+            _step_stats["calls"] += len(function_calls)
+
+        async def execute(call):
+            call["executions"] = call.get("executions", 0) + 1
+            with _step_stats_lock:
+                _step_stats["executions"] += 1
+            self.emit("tool_start", {
+                "call_id": call.get("call_id"),
+                "name": call["name"],
+                "inputs": call["inputs"],
+                "executions": call["executions"]
+            }, call_id=call.get("call_id"), name=call["name"])
+            return await self.execute_function(call["name"], call["inputs"])
+
+        async def run(call):
+            async with semaphore:
+                return await execute(call)
+
+        async def finish(call, result):
+            result = await self.record_function_result(call, result)
+            self.emit("tool_result", result, call_id=call.get("call_id"), name=call["name"], executions=call["executions"])
+            return result
+
+        results = [None] * len(function_calls)
+        batch = [i for i, call in enumerate(function_calls) if call["name"] not in INPUT_FUNCTIONS]
+        tasks = {i: asyncio.ensure_future(run(function_calls[i])) for i in batch}
+        for i in batch:
+            results[i] = await finish(function_calls[i], await tasks[i])
+
+        for i, call in enumerate(function_calls):
+            if call["name"] in INPUT_FUNCTIONS:
+                results[i] = await finish(call, await execute(call))
+        return results
+
+    async def record_function_result(self, call, result):
+        """
+        Fold a function result into the agent state; returns the result as the LLM should see it.
+
+        Campaign store writes run in a worker thread so their commits never block the event loop.
+        """
+        if call["name"] in ["google_search", "search_for_channels"]:
+            # Store results as candidates with IDs the LLM can reference later
+            if isinstance(result, list):
+                added = self.add_candidates(call["name"], call["inputs"], result)
+                await run_blocking(campaign_store.save_candidates, self.store_id, added["candidates"])
+                return added
+        elif call["name"] == "score_candidates":
+            if isinstance(result, dict) and "scored_candidates" in result:
+                self.state["scored_candidates"] = result["scored_candidates"]
+                self._dirty_keys.add("scored_candidates")
+                await run_blocking(campaign_store.save_scores, self.store_id, result["scored_candidates"], result.get("method"))
+        elif call["name"] == "prepare_outreach":
+            if isinstance(result, dict) and "outreach_messages" in result:
+                self.state["outreach_messages"] = result["outreach_messages"]
+                self._dirty_keys.add("outreach_messages")
+                await run_blocking(campaign_store.save_outreach_messages, self.store_id, result["outreach_messages"])
+        return result
+
     async def get_ai_response(self, user_input=""):
         """Get AI response and execute any function calls"""
 
@@ -453,16 +975,36 @@ class AutonomousOutreachAgent:
                 "content": user_input
             })
             if not self.state.get("raw_user_query"):
-                self.update_state("raw_user_query", user_input)
+                await self.update_state_async("raw_user_query", user_input)
 
-        context = f"""
-        Context:
-        Conversation history: {json.dumps(self.state["conversation_history"], indent=2)} \n
+        history_window, context_stats = build_history_window(self.state["conversation_history"])
+        self.last_context_stats = context_stats
+        if context_stats["tokens_saved"]:
+            print(f"🧠 Context: ~{context_stats['window_tokens']} tokens sent, ~{context_stats['tokens_saved']} saved "
+                  f"({context_stats['turns_compacted']} turns compacted, {context_stats['turns_dropped']} dropped)")
 
-        """
+        system_prompt, messages = history_to_messages(history_window)
+
+        def on_usage(usage):
+            context_stats["usage"] = usage
+            print(f"💾 Prompt cache: {usage['cache_read_input_tokens']} cached / "
+                  f"{usage['input_tokens'] + usage['cache_write_input_tokens']} uncached input tokens")
 
         try:
-            response = prompt_nova_lite(context)
+            if self._event_sink:
+                # Forward the thought to the event stream as it is generated
+                extractor = ThoughtStreamExtractor()
+
+                def on_delta(chunk):
+                    thought_delta = extractor.feed(chunk)
+                    if thought_delta:
+                        self.emit("thought_delta", thought_delta)
+
+                response = await prompt_nova_lite_stream_async(
+                    messages, on_delta, system=system_prompt, on_usage=on_usage, validate=is_json_reply
+                )
+            else:
+                response = await prompt_nova_lite_async(messages, system=system_prompt, on_usage=on_usage, validate=is_json_reply)
             parsed_response = to_json(response)
 
             self.state["conversation_history"].append({
@@ -477,74 +1019,175 @@ class AutonomousOutreachAgent:
             thought = parsed_response.get("thought", "")
             
             # Execute function calls if any
-            function_calls = parsed_response.get("function_calls", {})
-            function_result = None
-            
-            if function_calls and function_calls.get("name"):
-
-                # print("Thought:", thought)
-                # print(f"Executing function: {function_calls['name']} with inputs: {function_calls.get('inputs', {})}")
-                # print()
-                function_result = await self.execute_function(
-                    function_calls["name"], 
-                    function_calls.get("inputs", {})
-                )
+            function_calls = normalize_function_calls(parsed_response.get("function_calls", {}))
+            function_results = []
+            for i, call in enumerate(function_calls):
+                call["call_id"] = f"{self.steps_taken}.{i}"
+            if thought:
+                self.emit("thought", thought)
 
+            if function_calls:
+                function_results = await self.execute_function_calls(function_calls)
+
+                await self.save_state_async() # Save state after every function call
+
+                # All results of the turn go back to the model in one message
+                if len(function_calls) == 1:
+                    self.state["conversation_history"].append({
+                        "role": "tool",
+                        "name": function_calls[0]["name"],
+                        "content": json.dumps(function_results[0], separators=(",", ":"), default=str)
+                    })
+                else:
+                    self.state["conversation_history"].append({
+                        "role": "tool",
+                        "name": "parallel_calls",
+                        "content": json.dumps([
+                            {"name": call["name"], "inputs": call["inputs"], "result": result}
+                            for call, result in zip(function_calls, function_results)
+                        ], separators=(",", ":"), default=str)
+                    })
 
-                # Update state based on function call
-                if function_calls["name"] in ["google_search", "search_for_channels"]:
-                    # Assuming these return a list of candidates
-                    if isinstance(function_result, list):
-                        self.state["candidates"].extend(function_result)
-                elif function_calls["name"] == "score_candidates":
-                    if isinstance(function_result, dict) and "scored_candidates" in function_result:
-                        self.state["scored_candidates"] = function_result["scored_candidates"]
-                elif function_calls["name"] == "prepare_outreach":
-                     if isinstance(function_result, dict) and "outreach_messages" in function_result:
-                        self.state["outreach_messages"] = function_result["outreach_messages"]
-
-                self.save_state() # Save state after every function call
-
-                self.state["conversation_history"].append({
-                    "role": "user",
-                    "content": f"Executed function: {function_calls['name']} and received result: {function_result}"
-                })
-            
             return {
                 "thought": thought,
-                "function_result": function_result,
+                "function_results": function_results,
                 "function_calls": function_calls
             }
             
         except Exception as e:
             return f"Error getting AI response: {str(e)}"
 
+    async def step(self, user_input=""):
+        """
+        Run one agent step: ask the LLM, execute its function calls exactly once,
+        and describe what happened.
+
+        Returns a step event:
+            thought: The LLM's reasoning for this step
+            calls: [{"call_id", "name", "inputs", "result", "executions"}], input calls last
+            message: Text reply when the LLM did not produce a usable step (else None)
+            waiting_for_input: Whether the agent handed control back to the user
+            input_prompt: What the user was asked, if waiting
+        """
+        with _step_stats_lock:
+            _step_stats["steps"] += 1
+        self.steps_taken += 1
+
+        response = await self.get_ai_response(user_input)
+        if not isinstance(response, dict):
+            return {"thought": "", "calls": [], "message": response, "waiting_for_input": False, "input_prompt": None}
+
+        calls = [
+            {
+                "call_id": call["call_id"],
+                "name": call["name"],
+                "inputs": call["inputs"],
+                "result": result,
+                "executions": call.get("executions", 0)
+            }
+            for call, result in zip(response["function_calls"], response["function_results"])
+        ]
+        calls.sort(key=lambda call: call["name"] in INPUT_FUNCTIONS)
+        waiting = next((call for call in calls if call["name"] in INPUT_FUNCTIONS), None)
+        return {
+            "thought": response.get("thought", ""),
+            "calls": calls,
+            "message": None,
+            "waiting_for_input": waiting is not None,
+            "input_prompt": waiting["result"] if waiting else None
+        }
+
+    async def events(self, user_input="", max_steps=AGENT_MAX_STEPS):
+        """
+        Run the agent on user_input and yield typed events as they happen.
+
+        Steps run until the agent answers, waits for input, stops calling functions
+        or reaches max_steps. Events are agent_event dicts; their types, in order:
+            thought_delta: Next chunk of a step's thought while the LLM streams it
+            thought: The complete thought of a step
+            tool_start: A function call starts (call_id, name)
+            tool_progress: Intermediate output of a running tool (kind, e.g. "display_message")
+            tool_result: A function call finished (call_id, name, executions)
+            message: Text reply when the LLM did not produce a usable step
+            waiting_for_input: The agent handed control back to the user; ends the run
+            completion: The run finished without waiting for input
+            error: A step failed; ends the run
+        """
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+        pending = asyncio.Queue()
+
+        def sink(event):
+            # Tools running in executor threads hand their events over to the loop
+            if threading.get_ident() == loop_thread:
+                pending.put_nowait(event)
+            else:
+                loop.call_soon_threadsafe(pending.put_nowait, event)
+
+        self._event_sink = sink
+        task = None
+        try:
+            for step_number in range(max_steps):
+                task = asyncio.ensure_future(self.step(user_input if step_number == 0 else ""))
+                # None marks the end of the step's events
+                task.add_done_callback(lambda _: pending.put_nowait(None))
+                while True:
+                    event = await pending.get()
+                    if event is None:
+                        break
+                    yield event
+
+                try:
+                    step_event = task.result()
+                except Exception as e:
+                    yield agent_event("error", f"Error in agent logic: {str(e)}", self.session_id)
+                    return
+
+                if step_event["message"] is not None:
+                    yield agent_event("message", step_event["message"], self.session_id)
+                    break
+                if step_event["waiting_for_input"]:
+                    yield agent_event("waiting_for_input", step_event["input_prompt"], self.session_id)
+                    return
+                # Continue while the agent keeps calling functions
+                if not step_event["calls"]:
+                    break
+
+            yield agent_event("completion", "Task completed successfully!", self.session_id)
+        finally:
+            self._event_sink = None
+            if task is not None and not task.done():
+                task.cancel()
+
     def update_available_budget(self, new_budget:int):
         """Update the available budget balance"""
+        # Runs inline on the event loop; the state is saved with the rest of the turn
         self.state["budget_left"] = new_budget
-        self.save_state()
+        self._dirty_keys.add("budget_left")
         return f"Available budget updated to {new_budget}"
 
-    async def score_candidates_with_llm(self, candidates, user_query, user_preferences=None):
-        """
-        Score and rank candidates using LLM-based analysis.
+    def _shard_candidates(self, candidates):
+        """Split candidate indexes into batches bounded by SCORING_SHARD_SIZE and SCORING_SHARD_TOKEN_BUDGET"""
+        shards, current, tokens = [], [], 0
+        for index, candidate in enumerate(candidates):
+            cost = estimate_tokens(candidate)
+            if current and (len(current) >= SCORING_SHARD_SIZE or tokens + cost > SCORING_SHARD_TOKEN_BUDGET):
+                shards.append(current)
+                current, tokens = [], 0
+            current.append(index)
+            tokens += cost
+        if current:
+            shards.append(current)
+        return shards
 
-        Args:
-            candidates: List of candidate objects
-            user_query: The original user query describing what they're looking for
-            user_preferences: Dict containing user preferences (budget, location, etc.)
-
-        Returns:
-            List of scored and ranked candidates
+    async def _score_shard(self, candidates, user_query, user_preferences):
         """
-        if not candidates:
-            return []
-
-        if user_preferences is None:
-            user_preferences = self.state.get("user_preferences", {})
-            
-        print(f"📊 Scoring {len(candidates)} candidates using AI analysis...")
+        Score one batch of candidates with the LLM.
 
+        Returns (scored candidate copies, ranking summary); falls back to basic
+        scoring for this batch only if the LLM reply is unusable, tagging those
+        copies with score_method "basic_fallback".
+        """
         # Prepare the scoring prompt for the LLM
         scoring_prompt = f"""
         You are an expert recruiter and talent evaluator. Please analyze and score the following candidates based on the user's requirements.
@@ -555,7 +1198,7 @@ class AutonomousOutreachAgent:
         {json.dumps(user_preferences, indent=2)}
 
         CANDIDATES TO SCORE:
-        {json.dumps(candidates, indent=2)}
+        {json.dumps(candidates, separators=(",", ":"), default=str)}
 
         Please analyze each candidate and provide:
         1. A relevance score from 0-100 (100 being perfect match)
@@ -589,16 +1232,14 @@ class AutonomousOutreachAgent:
 
         try:
             # Get LLM response
-            llm_response = prompt_nova_lite(scoring_prompt)
-            
+            llm_response = await prompt_nova_lite_async(scoring_prompt, validate=is_json_reply)
+
             # Parse the LLM response
             scoring_result = to_json(llm_response)
-            
+
             if not scoring_result or "scored_candidates" not in scoring_result:
-                # Fallback to basic scoring if LLM fails
-                print("⚠️ LLM scoring failed, using basic scoring method")
-                return await self.score_candidates_basic(candidates, user_query, user_preferences)
-            
+                raise ValueError("LLM reply has no scored_candidates")
+
             # Apply scores to candidates
             scored_candidates = []
             for score_data in scoring_result["scored_candidates"]:
@@ -609,45 +1250,223 @@ class AutonomousOutreachAgent:
                     candidate["ai_strengths"] = score_data.get("strengths", [])
                     candidate["ai_concerns"] = score_data.get("concerns", [])
                     candidate["ai_reasoning"] = score_data.get("reasoning", "")
+                    candidate["score_method"] = "llm"
                     scored_candidates.append(candidate)
-            
-            # Sort by AI score
-            scored_candidates.sort(key=lambda x: x.get("ai_score", 0), reverse=True)
-            
-            # Apply budget constraints if specified
-            max_candidates = user_preferences.get("max_candidates", 10)
-            if max_candidates:
-                scored_candidates = scored_candidates[:max_candidates]
-            
-            # Update state
-            self.update_state("scored_candidates", scored_candidates)
-            
-            # Display results
-            print(f"✅ Successfully scored {len(scored_candidates)} candidates")
-            print(f"📈 Ranking Summary: {scoring_result.get('ranking_summary', 'No summary provided')}")
-            
-            # Show top candidates
-            print("\n🏆 TOP CANDIDATES:")
-            for i, candidate in enumerate(scored_candidates[:5], 1):
-                print(f"{i}. {candidate.get('name', 'Unknown')} - Score: {candidate.get('ai_score', 0)}")
-                if candidate.get('ai_strengths'):
-                    print(f"   Strengths: {', '.join(candidate['ai_strengths'])}")
-                if candidate.get('ai_concerns'):
-                    print(f"   Concerns: {', '.join(candidate['ai_concerns'])}")
-                print(f"   Reasoning: {candidate.get('ai_reasoning', 'No reasoning provided')}")
-                print("")
-            
-            return {
-                "scored_candidates": scored_candidates,
-                "total_scored": len(scored_candidates),
-                "ranking_summary": scoring_result.get('ranking_summary', ''),
-                "method": "llm_based"
+            return scored_candidates, scoring_result.get("ranking_summary", "")
+
+        except Exception as e:
+            # Fallback to basic scoring if LLM fails
+            print(f"⚠️ LLM scoring failed for a batch of {len(candidates)} ({str(e)}), using basic scoring method")
+            basic_result = await self.score_candidates_basic(candidates, user_query, user_preferences)
+            for candidate in basic_result["scored_candidates"]:
+                candidate["score_method"] = "basic_fallback"
+            return basic_result["scored_candidates"], ""
+
+    def _prefilter_for_scoring(self, candidates, user_query, min_kept=0):
+        """
+        Cut a large pool down to the candidates most similar to the query.
+
+        At least min_kept candidates are kept even if fewer reach
+        PREFILTER_MIN_SIMILARITY (see prefilter_candidates).
+
+        Returns the pool to score (kept candidates plus an evenly spread audit sample
+        of dropped ones, tagged with their similarity) and pre-filter stats.
+        """
+        kept, dropped, similarity = prefilter_candidates(
+            candidates, user_query, PREFILTER_TOP_K, PREFILTER_MIN_SIMILARITY, min_kept
+        )
+        threshold_ignored = any(similarity[i] < PREFILTER_MIN_SIMILARITY for i in kept)
+        if threshold_ignored:
+            print(f"🧹 Fewer than {min_kept} candidates reached similarity {PREFILTER_MIN_SIMILARITY}; "
+                  f"keeping the {len(kept)} most similar instead")
+        audit_size = min(PREFILTER_AUDIT_SAMPLE, len(dropped))
+        audited = [dropped[j * len(dropped) // audit_size] for j in range(audit_size)]
+
+        pool = [dict(candidates[i], prefilter_similarity=round(float(similarity[i]), 3)) for i in kept]
+        pool += [
+            dict(candidates[i], prefilter_similarity=round(float(similarity[i]), 3), prefilter_audit=True)
+            for i in audited
+        ]
+        print(f"🧹 Pre-filter kept {len(kept)} of {len(candidates)} candidates (+{audit_size} audit samples)")
+        return pool, {
+            "input": len(candidates),
+            "kept": len(kept),
+            "dropped": len(dropped),
+            "audited": audit_size,
+            "threshold_ignored": threshold_ignored
+        }
+
+    @staticmethod
+    def _prefilter_recall(scored_candidates, prefilter, top_n):
+        """
+        Estimate the pre-filter's recall of the LLM's final top N.
+
+        Audited candidates that reach the top N stand in for the dropped pool they
+        were sampled from; the estimate is kept / (kept + estimated missed).
+        """
+        top = scored_candidates[:top_n]
+        audited_in_top = sum(1 for candidate in top if candidate.get("prefilter_audit"))
+        kept_in_top = len(top) - audited_in_top
+        for candidate in scored_candidates:
+            candidate.pop("prefilter_audit", None)
+        if not prefilter["audited"]:
+            return None
+        missed = audited_in_top * prefilter["dropped"] / prefilter["audited"]
+        return kept_in_top / (kept_in_top + missed) if kept_in_top + missed else 1.0
+
+    async def _rerank_top_candidates(self, scored_candidates, user_query, top_k):
+        """
+        Re-rank the top K candidates head-to-head in a single LLM call.
+
+        The top K scores are reassigned in the new order so sorting stays consistent.
+        """
+        top = scored_candidates[:top_k]
+        summary = [
+            {
+                "id": i,
+                "name": candidate.get("name") or candidate.get("channel_name", "Unknown"),
+                "description": str(candidate.get("description", ""))[:300],
+                "score": candidate.get("ai_score", 0),
+                "strengths": candidate.get("ai_strengths", [])
             }
-            
+            for i, candidate in enumerate(top)
+        ]
+        rerank_prompt = f"""
+        You are comparing the finalists for this request: {user_query}
+
+        FINALISTS:
+        {json.dumps(summary, separators=(",", ":"), default=str)}
+
+        Compare them head-to-head and order them from best to worst fit.
+        Return only a JSON object: {{"ranking": [ids best first], "reasoning": "one sentence"}}
+        """
+        try:
+            ranking = (to_json(await prompt_nova_lite_async(rerank_prompt, validate=is_json_reply)) or {}).get("ranking", [])
+            order = [i for i in dict.fromkeys(ranking) if isinstance(i, int) and 0 <= i < len(top)]
+            order += [i for i in range(len(top)) if i not in order]
+        except Exception as e:
+            print(f"⚠️ Head-to-head re-rank failed, keeping calibrated order: {str(e)}")
+            return scored_candidates
+
+        scores = sorted((candidate.get("ai_score", 0) for candidate in top), reverse=True)
+        reranked = []
+        for rank, i in enumerate(order):
+            candidate = top[i]
+            candidate["ai_score"] = scores[rank]
+            candidate["ai_rerank_position"] = rank + 1
+            reranked.append(candidate)
+        return reranked + scored_candidates[top_k:]
+
+    async def score_candidates_with_llm(self, candidates, user_query, user_preferences=None):
+        """
+        Score and rank candidates using LLM-based analysis.
+
+        Large pools are split into batches that are scored concurrently
+        (at most SCORING_CONCURRENCY at once), calibrated onto a common scale
+        and optionally re-ranked head-to-head for the top SCORING_RERANK_TOP_K.
+
+        Args:
+            candidates: List of candidate objects
+            user_query: The original user query describing what they're looking for
+            user_preferences: Dict containing user preferences (budget, location, etc.)
+
+        Returns:
+            List of scored and ranked candidates
+        """
+        if not candidates:
+            return []
+
+        if user_preferences is None:
+            user_preferences = self.state.get("user_preferences", {})
+
+        all_candidates = candidates
+        prefilter = None
+        if PREFILTER_TOP_K and len(candidates) > PREFILTER_TOP_K:
+            candidates, prefilter = await run_blocking(
+                self._prefilter_for_scoring, candidates, user_query, user_preferences.get("max_candidates") or 10
+            )
+
+        shards = self._shard_candidates(candidates)
+        print(f"📊 Scoring {len(candidates)} candidates using AI analysis ({len(shards)} batches)...")
+
+        semaphore = asyncio.Semaphore(SCORING_CONCURRENCY)
+
+        async def score(indexes):
+            async with semaphore:
+                return await self._score_shard([candidates[i] for i in indexes], user_query, user_preferences)
+
+        try:
+            shard_results = await asyncio.gather(*(score(indexes) for indexes in shards))
         except Exception as e:
             print(f"⚠️ Error in LLM scoring: {str(e)}")
             print("Falling back to basic scoring method")
-            return await self.score_candidates_basic(candidates, user_query, user_preferences)
+            return await self.score_candidates_basic(all_candidates, user_query, user_preferences)
+
+        # Batches the LLM failed on carry keyword scores on another scale; they are
+        # kept out of calibration and re-ranking and ranked after the LLM-scored ones
+        def is_fallback(scored):
+            return any(candidate.get("score_method") == "basic_fallback" for candidate in scored)
+
+        llm_shards = [scored for scored, _ in shard_results if not is_fallback(scored)]
+        fallback_shards = [scored for scored, _ in shard_results if is_fallback(scored)]
+        if len(llm_shards) > 1:
+            calibrate_shard_scores(llm_shards)
+        summaries = [summary for _, summary in shard_results if summary]
+        ranking_summary = summaries[0] if len(summaries) == 1 else " ".join(summaries)
+
+        # Sort by AI score
+        scored_candidates = sorted(
+            (candidate for scored in llm_shards for candidate in scored),
+            key=lambda x: x.get("ai_score", 0), reverse=True
+        )
+        if len(llm_shards) > 1 and SCORING_RERANK_TOP_K > 1:
+            scored_candidates = await self._rerank_top_candidates(scored_candidates, user_query, SCORING_RERANK_TOP_K)
+        scored_candidates += sorted(
+            (candidate for scored in fallback_shards for candidate in scored),
+            key=lambda x: x.get("ai_score", 0), reverse=True
+        )
+        if fallback_shards:
+            print(f"⚠️ {len(fallback_shards)} of {len(shards)} scoring batches fell back to basic scoring; "
+                  f"their candidates are ranked after the AI-scored ones")
+
+        # Apply budget constraints if specified
+        max_candidates = user_preferences.get("max_candidates", 10)
+        if prefilter:
+            prefilter["estimated_recall"] = self._prefilter_recall(
+                scored_candidates, prefilter, max_candidates or len(scored_candidates)
+            )
+            self.state.setdefault("prefilter_runs", []).append(prefilter)
+            if prefilter["estimated_recall"] is not None:
+                print(f"🧹 Pre-filter estimated recall of final top {max_candidates}: {prefilter['estimated_recall']:.0%}")
+        if max_candidates:
+            scored_candidates = scored_candidates[:max_candidates]
+
+        # Update state
+        await self.update_state_async("scored_candidates", scored_candidates)
+
+        # Display results
+        print(f"✅ Successfully scored {len(scored_candidates)} candidates")
+        print(f"📈 Ranking Summary: {ranking_summary or 'No summary provided'}")
+
+        # Show top candidates
+        print("\n🏆 TOP CANDIDATES:")
+        for i, candidate in enumerate(scored_candidates[:5], 1):
+            print(f"{i}. {candidate.get('name', 'Unknown')} - Score: {candidate.get('ai_score', 0)}")
+            if candidate.get('ai_strengths'):
+                print(f"   Strengths: {', '.join(candidate['ai_strengths'])}")
+            if candidate.get('ai_concerns'):
+                print(f"   Concerns: {', '.join(candidate['ai_concerns'])}")
+            print(f"   Reasoning: {candidate.get('ai_reasoning', 'No reasoning provided')}")
+            print("")
+
+        return {
+            "scored_candidates": scored_candidates,
+            "total_scored": len(scored_candidates),
+            "ranking_summary": ranking_summary,
+            "method": scoring_method(len(shards), len(fallback_shards)),
+            "failed_shards": len(fallback_shards),
+            "prefilter": prefilter
+        }
 
     async def score_candidates_basic(self, candidates, user_query, user_preferences=None):
         """
@@ -658,45 +1477,21 @@ class AutonomousOutreachAgent:
 
         print("📊 Using basic scoring method...")
 
+        scores, relevance, audience = await run_blocking(score_candidate_pool, candidates, user_query)
+
         scored_candidates = []
-        for i, candidate in enumerate(candidates):
-            candidate_copy = candidate.copy()
-            
-            # Basic scoring based on available data
-            score = 50  # Base score
-            
-            # Score based on name/title relevance
-            name = candidate.get('name', '').lower()
-            description = candidate.get('description', '').lower()
-            query_words = user_query.lower().split()
-            
-            for word in query_words:
-                if word in name or word in description:
-                    score += 10
-            
-            # Score based on subscriber/follower count
-            subscribers = candidate.get('subscribers', 0)
-            if isinstance(subscribers, (int, float)) and subscribers > 0:
-                if subscribers > 100000:
-                    score += 20
-                elif subscribers > 10000:
-                    score += 15
-                elif subscribers > 1000:
-                    score += 10
-            
-            # Cap the score at 100
-            score = min(score, 100)
-            
-            candidate_copy["ai_score"] = score
+        # Stable descending sort keeps search order among equal scores
+        for i in np.argsort(-scores, kind="stable"):
+            candidate_copy = candidates[i].copy()
+            candidate_copy["ai_score"] = float(scores[i])
             candidate_copy["ai_strengths"] = ["Basic scoring applied"]
             candidate_copy["ai_concerns"] = ["Limited analysis available"]
-            candidate_copy["ai_reasoning"] = "Basic scoring based on keyword matching and audience size"
-            
+            candidate_copy["ai_reasoning"] = (
+                f"Basic scoring: keyword relevance {relevance[i]:.2f} (BM25), "
+                f"audience {int(audience[i]):,}"
+            )
             scored_candidates.append(candidate_copy)
 
-        # Sort by score
-        scored_candidates.sort(key=lambda x: x.get("ai_score", 0), reverse=True)
-
         return {
             "scored_candidates": scored_candidates,
             "total_scored": len(scored_candidates),
@@ -729,91 +1524,111 @@ class AutonomousOutreachAgent:
                 
             print(f"✍️ Preparing personalized outreach messages for {len(candidates)} candidates using AI...")
             
-            outreach_messages = {}
-            
-            for i, candidate in enumerate(candidates, 1):
-                try:
-                    print(f"📝 Generating message {i}/{len(candidates)}: {candidate.get('name', 'Unknown')}")
-                    
-                    # Create comprehensive prompt for LLM
-                    outreach_prompt = f"""
-                    You are an expert outreach specialist. Create a highly personalized and compelling outreach email.
+            semaphore = asyncio.Semaphore(OUTREACH_CONCURRENCY)
 
-                    CONTEXT:
-                    User Query: {user_query}
-                    
-                    SENDER INFORMATION:
-                    {json.dumps(sender_info, indent=2)}
-                    
-                    USER PREFERENCES:
-                    {json.dumps(user_preferences, indent=2)}
-                    
-                    CANDIDATE DETAILS:
-                    Name: {candidate.get('name', 'Unknown')}
-                    Description: {candidate.get('description', 'No description available')}
-                    URL: {candidate.get('url', 'No URL available')}
-                    Source: {candidate.get('source', 'Unknown')}
-                    AI Score: {candidate.get('ai_score', 'N/A')}
-                    AI Strengths: {candidate.get('ai_strengths', [])}
-                    Subscribers/Followers: {candidate.get('subscribers', 'Unknown')}
-                    
-                    REQUIREMENTS:
-                    1. Create a personalized email that doesn't sound generic
-                    2. Reference specific details about the candidate's work/expertise
-                    3. Clearly explain the opportunity and value proposition
-                    4. Include relevant budget/compensation information if available
-                    5. Make it professional but warm and engaging
-                    6. Include a clear call-to-action
-                    7. Keep it concise but compelling (2-3 paragraphs max)
-                    
-                    Return your response as a JSON object with this structure:
-                    {{
-                        "subject": "Compelling subject line",
-                        "body": "Full email body with personalization",
-                        "key_personalization": "Brief note about what made this personal",
-                        "call_to_action": "The specific action you want them to take"
-                    }}
-                    
-                    Make sure the email feels authentic and specifically tailored to this candidate based on their background and the user's needs.
-                    """
-                    
-                    # Get LLM response
-                    llm_response = prompt_nova_lite(outreach_prompt)
-                    
-                    # Parse the LLM response
-                    try:
-                        message_data = to_json(llm_response)
-                        
-                        if not message_data or "subject" not in message_data:
-                            # Fallback to basic template
-                            message_data = self._create_basic_outreach_template(candidate, user_query, user_preferences, sender_info)
-                            
-                    except Exception as parse_error:
-                        print(f"⚠️ Error parsing LLM response for {candidate.get('name', 'Unknown')}: {parse_error}")
-                        message_data = self._create_basic_outreach_template(candidate, user_query, user_preferences, sender_info)
-                    
-                    # Add candidate info to message
-                    message_data["candidate"] = candidate
-                    message_data["candidate_name"] = candidate.get('name', 'Unknown')
-                    message_data["candidate_email"] = candidate.get('email', '')
-                    message_data["candidate_contact"] = candidate.get('contact_info', {})
-                    message_data["generated_method"] = "llm"
-                    
-                    # Store the message
-                    outreach_messages[candidate.get('name', f'Candidate_{i}')] = message_data
-                    
-                    print(f"✅ Generated personalized message for {candidate.get('name', 'Unknown')}")
-                    
+            async def draft(i, candidate):
+                """Draft one candidate's message; returns (i, message key, message data)"""
+                try:
+                    async with semaphore:
+                        print(f"📝 Generating message {i}/{len(candidates)}: {candidate.get('name', 'Unknown')}")
+                        return await generate(i, candidate)
                 except Exception as e:
                     print(f"❌ Error generating message for {candidate.get('name', 'Unknown')}: {str(e)}")
                     # Create fallback message
                     fallback_message = self._create_basic_outreach_template(candidate, user_query, user_preferences, sender_info)
                     fallback_message["candidate"] = candidate
                     fallback_message["generated_method"] = "fallback"
-                    outreach_messages[candidate.get('name', f'Candidate_{i}')] = fallback_message
-            
+                    return i, candidate.get('name', f'Candidate_{i}'), fallback_message
+
+            async def generate(i, candidate):
+                """Draft one candidate's message with the LLM, falling back to the template on a bad reply"""
+                # Create comprehensive prompt for LLM
+                outreach_prompt = f"""
+                You are an expert outreach specialist. Create a highly personalized and compelling outreach email.
+
+                CONTEXT:
+                User Query: {user_query}
+                
+                SENDER INFORMATION:
+                {json.dumps(sender_info, indent=2)}
+                
+                USER PREFERENCES:
+                {json.dumps(user_preferences, indent=2)}
+                
+                CANDIDATE DETAILS:
+                Name: {candidate.get('name', 'Unknown')}
+                Description: {candidate.get('description', 'No description available')}
+                URL: {candidate.get('url', 'No URL available')}
+                Source: {candidate.get('source', 'Unknown')}
+                AI Score: {candidate.get('ai_score', 'N/A')}
+                AI Strengths: {candidate.get('ai_strengths', [])}
+                Subscribers/Followers: {candidate.get('subscribers', 'Unknown')}
+                
+                REQUIREMENTS:
+                1. Create a personalized email that doesn't sound generic
+                2. Reference specific details about the candidate's work/expertise
+                3. Clearly explain the opportunity and value proposition
+                4. Include relevant budget/compensation information if available
+                5. Make it professional but warm and engaging
+                6. Include a clear call-to-action
+                7. Keep it concise but compelling (2-3 paragraphs max)
+                
+                Return your response as a JSON object with this structure:
+                {{
+                    "subject": "Compelling subject line",
+                    "body": "Full email body with personalization",
+                    "key_personalization": "Brief note about what made this personal",
+                    "call_to_action": "The specific action you want them to take"
+                }}
+                
+                Make sure the email feels authentic and specifically tailored to this candidate based on their background and the user's needs.
+                """
+                
+                # Get LLM response
+                llm_response = await prompt_nova_lite_async(outreach_prompt, validate=is_json_reply)
+                
+                # Parse the LLM response
+                try:
+                    message_data = to_json(llm_response)
+                    
+                    if not message_data or "subject" not in message_data:
+                        # Fallback to basic template
+                        message_data = self._create_basic_outreach_template(candidate, user_query, user_preferences, sender_info)
+                        
+                except Exception as parse_error:
+                    print(f"⚠️ Error parsing LLM response for {candidate.get('name', 'Unknown')}: {parse_error}")
+                    message_data = self._create_basic_outreach_template(candidate, user_query, user_preferences, sender_info)
+                
+                # Add candidate info to message
+                message_data["candidate"] = candidate
+                message_data["candidate_name"] = candidate.get('name', 'Unknown')
+                message_data["candidate_email"] = candidate.get('email', '')
+                message_data["candidate_contact"] = candidate.get('contact_info', {})
+                message_data.setdefault("generated_method", "llm")
+
+                print(f"✅ Generated personalized message for {candidate.get('name', 'Unknown')}")
+                return i, candidate.get('name', f'Candidate_{i}'), message_data
+
+            # Draft concurrently and stream each draft as soon as it is ready
+            drafts = []
+            for finished in asyncio.as_completed([draft(i, candidate) for i, candidate in enumerate(candidates, 1)]):
+                i, key, message_data = await finished
+                drafts.append((i, key, message_data))
+                self.emit("tool_progress", {
+                    'candidate_name': key,
+                    'subject': message_data.get('subject', ''),
+                    'generated_method': message_data.get('generated_method', 'unknown'),
+                    'completed': len(drafts),
+                    'total': len(candidates)
+                }, kind="outreach_draft")
+
+            # Store the messages in candidate order, whatever order they finished in
+            outreach_messages = {}
+            for i, key, message_data in sorted(drafts, key=lambda item: item[0]):
+                outreach_messages[key] = message_data
+
             # Update state
-            self.update_state("outreach_messages", outreach_messages)
+            await self.update_state_async("outreach_messages", outreach_messages)
             
             # Display summary
             print(f"📧 Successfully prepared {len(outreach_messages)} personalized outreach messages")
@@ -888,18 +1703,26 @@ class AutonomousOutreachAgent:
     def update_state(self, key, value):
         """Update a specific state key"""
         self.state[key] = value
+        self._dirty_keys.add(key)
         self.save_state()
+
+    async def update_state_async(self, key, value):
+        """update_state() for coroutines; the save runs off the event loop"""
+        self.state[key] = value
+        self._dirty_keys.add(key)
+        await self.save_state_async()
         
     async def run_agent(self, user_input=""):
         """Run the agent with the provided user input"""
         self.load_state()
         while True:
-            response = await self.get_ai_response(user_input)
-            if not response or not response.get("function_calls") or len(response.get("function_calls", {}).keys()) == 0:
+            event = await self.step(user_input)
+            user_input = ""
+            if not event["calls"]:
                 break
-            if response.get("function_calls").get("name") == "display_to_user_and_wait_for_input":
-                return response.get("function_calls").get("inputs", {}).get("message", "")
-        self.save_state()
+            if event["waiting_for_input"]:
+                return event["calls"][-1]["inputs"].get("message", "")
+        await self.save_state_async()
         return self.state
     
 # Main execution
@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Agent runs executing at the same time, across all sessions
+AGENT_RUNTIME_WORKERS = int(os.getenv("AGENT_RUNTIME_WORKERS", "8"))
+# Jobs allowed to wait for a worker; submissions beyond this are rejected
+AGENT_RUNTIME_QUEUE_SIZE = int(os.getenv("AGENT_RUNTIME_QUEUE_SIZE", "100"))
+# How long shutdown waits for queued and running jobs to finish
+AGENT_RUNTIME_DRAIN_SECONDS = float(os.getenv("AGENT_RUNTIME_DRAIN_SECONDS", "30"))
+
+
+class RuntimeFullError(Exception):
+    """The job queue is full; the caller should retry later"""
+
+
+class RuntimeStoppedError(Exception):
+    """The runtime is draining or stopped and accepts no new jobs"""
+
+
+class AgentRuntime:
+    """
+    One long-lived asyncio loop, in its own thread, that runs session jobs.
+
+    Jobs are coroutine functions submitted from any thread. They wait in a bounded
+    queue and run on a fixed number of worker tasks, so a burst of requests never
+    creates more than `workers` concurrent agent runs or new event loops. Jobs of
+    the same session run one at a time, in submission order, without holding a
+    worker while they wait. submit() rejects jobs when the queue is full
+    (admission control) or the runtime is draining.
+    """
+
+    def __init__(self, workers=AGENT_RUNTIME_WORKERS, queue_size=AGENT_RUNTIME_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._accepting = True
+        self._loop = None
+        self._thread = None
+        self._queue = None
+        self._stopping = None
+        self._running_sessions = {}  # session_id -> deque of its jobs waiting behind the running one
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self.max_queue_depth = 0
+
+    def _start(self):
+        """Start the loop thread on first use; called with the lock held"""
+        if self._thread is not None:
+            return
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._main(ready))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="agent-runtime", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    async def _main(self, ready):
+        self._queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        ready.set()
+        await self._stopping.wait()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            session_id = job[0]
+            if session_id in self._running_sessions:
+                # Another worker is running this session; it picks the job up next
+                self._running_sessions[session_id].append(job)
+                continue
+            self._running_sessions[session_id] = deque()
+            try:
+                while job is not None:
+                    await self._run_job(*job)
+                    waiting = self._running_sessions[session_id]
+                    job = waiting.popleft() if waiting else None
+            finally:
+                del self._running_sessions[session_id]
+
+    async def _run_job(self, session_id, job, future, submitted_at):
+        started_at = time.monotonic()
+        waited = started_at - submitted_at
+        with self._lock:
+            self.started += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        failed = False
+        try:
+            future.set_result(await job())
+        except BaseException as e:
+            # Anything a job raises, cancellation included, fails only that job; the
+            # worker keeps serving unless the runtime itself is shutting down
+            failed = True
+            print(f"❌ Agent job for session {session_id} failed: {type(e).__name__}: {str(e)}")
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            if self._stopping.is_set():
+                raise
+        finally:
+            with self._idle:
+                self.completed += 1
+                self.failed += failed
+                self.total_run += time.monotonic() - started_at
+                self._idle.notify_all()
+
+    def submit(self, session_id, job):
+        """
+        Queue a job for a session.
+
+        Args:
+            session_id: Jobs with the same session ID never run concurrently
+            job: Coroutine function taking no arguments
+
+        Returns:
+            concurrent.futures.Future with the job's result
+
+        Raises:
+            RuntimeFullError: AGENT_RUNTIME_QUEUE_SIZE jobs are already waiting
+            RuntimeStoppedError: The runtime is shutting down
+        """
+        with self._lock:
+            if not self._accepting:
+                raise RuntimeStoppedError("Agent runtime is shutting down")
+            queued = self.submitted - self.started
+            if queued >= self.queue_size:
+                self.rejected += 1
+                raise RuntimeFullError(f"Agent runtime queue is full ({queued} jobs waiting)")
+            self._start()
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, queued + 1)
+
+        future = Future()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (session_id, job, future, time.monotonic()))
+        return future
+
+    def shutdown(self, timeout=AGENT_RUNTIME_DRAIN_SECONDS):
+        """
+        Stop accepting jobs, wait up to timeout seconds for queued and running jobs
+        to finish, then stop the loop. Returns the number of jobs cut off.
+        """
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            self._accepting = False
+            if self._thread is None or not self._thread.is_alive():
+                return 0
+            pending = self.submitted - self.completed
+            if pending:
+                print(f"⏳ Draining {pending} agent jobs...")
+            while self.submitted > self.completed and time.monotonic() < deadline:
+                self._idle.wait(timeout=deadline - time.monotonic())
+            unfinished = self.submitted - self.completed
+
+        if unfinished:
+            print(f"⚠️ Agent runtime stopped with {unfinished} unfinished jobs")
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join(timeout=5)
+        return unfinished
+
+    def stats(self):
+        """Queue depth, active sessions, admission counters and wait/run times"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "accepting": self._accepting,
+                "queued": self.submitted - self.started,
+                "active": self.started - self.completed,
+                "max_queue_depth": self.max_queue_depth,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_seconds": self.total_wait / self.started if self.started else 0.0,
+                "max_wait_seconds": self.max_wait,
+                "avg_run_seconds": self.total_run / self.completed if self.completed else 0.0
+            }
+
+
+agent_runtime = AgentRuntime()
@@ -1,126 +1,286 @@
 import os
 from flask import Flask, render_template, request, jsonify, Response
 import json
-import asyncio
 from datetime import datetime
 import uuid
-from agent import AutonomousOutreachAgent, set_display_handler, set_input_handler
+from agent import AutonomousOutreachAgent, set_input_handler, agent_step_stats, run_blocking
+from llm_cache import llm_cache
+from singleflight import llm_flight, tool_flight
+from prompt_llms import bedrock_limiter, usage_stats
+from tool_executor import tool_pool_stats
+from tool_registry import tool_registry
+from campaign_store import campaign_store
+from agent_runtime import agent_runtime, RuntimeFullError, RuntimeStoppedError
+from stream_hub import BroadcastHub, SlowConsumerError
+import atexit
+import signal
+import sys
 import threading
-from queue import Queue
 import pickle
+from functools import partial
 
 from process_follow_up_mail import extract_details_from_pubsub_event, extract_mail_details_from_message_id, extract_new_mails_from_history_id, mark_message_as_read
 
 app = Flask(__name__)
 
+# Sessions saved by older versions; imported into the campaign store on startup
 SESSIONS_FILE = 'active_sessions.pkl'
 
+# Seconds a stream may sit idle before it sends a heartbeat
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Most queued messages written to a stream in one chunk
+SSE_BATCH_MAX = int(os.getenv("SSE_BATCH_MAX", "100"))
+
+# Process-wide stream counters; messages per write shows how much batching saves
+_stream_stats = {"opened": 0, "closed": 0, "messages": 0, "writes": 0, "heartbeats": 0}
+_stream_stats_lock = threading.Lock()
+
+def stream_stats():
+    """Open SSE streams, their message, write and heartbeat counts, and session buffer occupancy"""
+    with _stream_stats_lock:
+        stats = dict(_stream_stats)
+    stats["open"] = stats["opened"] - stats["closed"]
+    stats["messages_per_write"] = stats["messages"] / stats["writes"] if stats["writes"] else 0.0
+
+    hubs = [streaming_agent.hub.stats() for streaming_agent in list(active_sessions.values())]
+    stats["buffers"] = {
+        "sessions": len(hubs),
+        "subscribers": sum(hub["subscribers"] for hub in hubs),
+        "buffered": sum(hub["buffered"] for hub in hubs),
+        "max_occupancy": max((hub["occupancy"] for hub in hubs), default=0.0),
+        "dropped": sum(hub["dropped"] for hub in hubs),
+        "disconnected": sum(hub["disconnected"] for hub in hubs)
+    }
+    return stats
+
+def sse_frame(message, seq=None):
+    """One SSE frame; hub messages carry their sequence number as the event ID clients resume from"""
+    event_id = f"id: {seq}\n" if seq is not None else ""
+    return f"{event_id}data: {json.dumps(message, default=str)}\n\n"
+
+# Agent event type -> message type the chat interface renders
+MESSAGE_TYPES = {
+    'thought_delta': 'agent_thought_delta',
+    'thought': 'agent_thought',
+    'tool_start': 'function_call',
+    'tool_result': 'function_result',
+    'message': 'agent_response',
+    'waiting_for_input': 'input_request',
+    'completion': 'completion',
+    'error': 'error'
+}
+
 class StreamingAgent:
     def __init__(self, session_id):
         self.session_id = session_id
         self.agent = AutonomousOutreachAgent(session_id)
         self.agent.set_streaming_agent(self)  # Set reference back to streaming agent
-        self.message_queue = Queue()
         self.is_active = True
         self.waiting_for_input = False
         self.pending_input_prompt = None
+        self.hub = BroadcastHub()  # Messages of the session's runs, fanned out to every open stream
         
         # Set up handlers for the agent to use this streaming interface
         self.setup_handlers()
         
     def setup_handlers(self):
-        """Setup handlers for display and input to work with streaming"""
-        def stream_display(message):
-            self.add_message('display_message', message)
-        
+        """Setup the input handler so waiting for input never blocks a run"""
         def stream_input(prompt, session_id):
-            # Set waiting state and add the input request message
-            self.waiting_for_input = True
-            self.pending_input_prompt = prompt
-            # self.add_message('input_request', prompt)
-            # Return empty string for now - the actual input will come via the web interface
+            # The wait is reported by the agent's waiting_for_input event;
+            # the actual input will come via the web interface
             return ""
         
-        set_display_handler(stream_display)
         set_input_handler(stream_input)
         
-    def add_message(self, message_type, content):
-        """Add a message to the streaming queue"""
-        message = {
+    def make_message(self, message_type, content):
+        """Build a stream message"""
+        return {
             'type': message_type,
             'content': content,
             'timestamp': datetime.now().isoformat(),
             'session_id': self.session_id
         }
-        self.message_queue.put(message)
-    
-    def get_messages(self):
-        """Generator to yield messages from queue"""
-        while self.is_active or not self.message_queue.empty():
-            try:
-                if not self.message_queue.empty():
-                    message = self.message_queue.get(timeout=0.1)
-                    yield f"data: {json.dumps(message)}\n\n"
-                else:
-                    # Send heartbeat to keep connection alive
-                    yield f"data: {json.dumps({'type': 'heartbeat', 'timestamp': datetime.now().isoformat()})}\n\n"
-                    import time
-                    time.sleep(1)
-            except:
-                break
-                
 
-def load_active_sessions():
-    """Load active sessions from a pickle file"""
+    def to_message(self, event):
+        """Stream message for an agent event; also tracks whether the agent waits for input"""
+        if event['type'] == 'waiting_for_input':
+            self.waiting_for_input = True
+            self.pending_input_prompt = event['content']
+            return dict(event, type='input_request', content='Waiting for your input to continue...')
+        if event['type'] == 'tool_result':
+            print(f"Function {event['name']} executed with result: {event['content']}")
+            if event['executions'] != 1:
+                print(f"⚠️ Function call {event['call_id']} ({event['name']}) ran {event['executions']} times")
+        if event['type'] == 'tool_progress':
+            return dict(event, type=event.get('kind', 'info'))
+        return dict(event, type=MESSAGE_TYPES[event['type']])
+
+    async def run_messages(self, user_input, user_message=None):
+        """Messages of one agent run, taken straight from the agent's event generator"""
+        if user_message is not None:
+            yield self.make_message('user_message', user_message)
+        try:
+            async for event in self.agent.events(user_input):
+                yield self.to_message(event)
+        except Exception as e:
+            yield self.make_message('error', f'Error processing message: {str(e)}')
+
+    def start_run(self, user_input, user_message=None, prepare=None):
+        """
+        Queue an agent run on the shared agent runtime; its messages go to the session's stream.
+
+        prepare is an optional blocking callable that runs in a worker thread when the
+        job starts, before the agent; the run is skipped if it returns False.
+
+        Raises RuntimeFullError or RuntimeStoppedError when the runtime does not admit it.
+        """
+        async def run():
+            if prepare is not None and not await run_blocking(prepare):
+                return
+            async for message in self.run_messages(user_input, user_message):
+                self.publish(message)
+
+        return agent_runtime.submit(self.session_id, run)
+
+    def save_state(self, compact=False):
+        """
+        Persist (or compact) the agent's state as a job of the session, so it never
+        races a run on the runtime loop. Once the runtime has stopped nothing runs
+        any more and the state is saved directly.
+        """
+        save = self.agent.compact_state if compact else self.agent.save_state
+        try:
+            return agent_runtime.submit(self.session_id, lambda: run_blocking(save))
+        except RuntimeStoppedError:
+            save()
+        except RuntimeFullError:
+            print(f"⚠️ Agent runtime busy; state of session {self.session_id} is saved with its next run")
+
+    def publish(self, message):
+        """Send a message to every open stream of the session"""
+        self.hub.publish(message)
+
+    def close(self):
+        """End the session's streams once they have sent what is buffered"""
+        self.is_active = False
+        self.hub.close()
+
+    def get_messages(self, heartbeat_seconds=SSE_HEARTBEAT_SECONDS, batch_max=SSE_BATCH_MAX, last_event_id=None):
+        """
+        Generator of SSE chunks for one subscriber of this session.
+
+        Each stream reads the session's broadcast hub at its own cursor, so every open
+        tab receives every message. Reads block, so an idle stream costs no CPU and a
+        new message is written the moment it is published. Messages published together
+        (e.g. a burst of thought deltas) go out as one chunk of up to batch_max frames.
+        A heartbeat is sent only after heartbeat_seconds without messages.
+
+        Each message frame carries its sequence number as the event ID; a reconnecting
+        client's last_event_id resumes the stream from the buffer (see BroadcastHub.subscribe).
+        """
+        subscriber = self.hub.subscribe(last_event_id)
+        with _stream_stats_lock:
+            _stream_stats["opened"] += 1
+        try:
+            while True:
+                try:
+                    messages = subscriber.read(timeout=heartbeat_seconds, max_items=batch_max)
+                except SlowConsumerError:
+                    yield sse_frame(self.make_message('info', 'This stream fell too far behind and was closed; reconnect to continue.'))
+                    break
+                if messages is None:
+                    # Session ended
+                    break
+
+                chunk = ""
+                if subscriber.skipped:
+                    chunk += sse_frame(self.make_message('info', f'{subscriber.skipped} messages were skipped because this stream fell behind.'))
+                    subscriber.skipped = 0
+                if not messages and not chunk:
+                    # Send heartbeat to keep connection alive
+                    with _stream_stats_lock:
+                        _stream_stats["heartbeats"] += 1
+                    yield sse_frame({'type': 'heartbeat', 'timestamp': datetime.now().isoformat()})
+                    continue
+
+                with _stream_stats_lock:
+                    _stream_stats["messages"] += len(messages)
+                    _stream_stats["writes"] += 1
+                first_seq = subscriber.cursor - len(messages)
+                yield chunk + "".join(sse_frame(message, first_seq + i) for i, message in enumerate(messages))
+        finally:
+            subscriber.close()
+            with _stream_stats_lock:
+                _stream_stats["closed"] += 1
+
+
+def import_legacy_sessions():
+    """One-time import of sessions saved by older versions in a pickle file"""
     if not os.path.exists(SESSIONS_FILE):
-        return {}
-    
+        return
     try:
         with open(SESSIONS_FILE, 'rb') as f:
             sessions_data = pickle.load(f)
-        
+        for session_id, session_data in sessions_data.items():
+            campaign_store.save_session(
+                session_id,
+                is_active=session_data.get('is_active', True),
+                waiting_for_input=session_data.get('waiting_for_input', False),
+                pending_input_prompt=session_data.get('pending_input_prompt', None)
+            )
+            agent = AutonomousOutreachAgent(session_id)
+            if 'agent_state' in session_data and agent.journal.load() is None:
+                agent.state = session_data['agent_state']
+                agent.compact_state()
+        os.replace(SESSIONS_FILE, f"{SESSIONS_FILE}.imported")
+    except Exception as e:
+        print(f"Error importing legacy sessions: {e}")
+
+def load_active_sessions():
+    """Load active sessions from the campaign store"""
+    try:
+        import_legacy_sessions()
+        campaign_store.import_legacy_files()
+
         # Reconstruct StreamingAgent objects
         active_sessions = {}
-        for session_id, session_data in sessions_data.items():
+        for session_data in campaign_store.active_sessions():
+            session_id = session_data['session_id']
             streaming_agent = StreamingAgent(session_id)
-            
+
             # Restore agent state
-            if 'agent_state' in session_data:
-                streaming_agent.agent.state = session_data['agent_state']
-            
+            streaming_agent.agent.load_state()
+
             # Restore streaming agent properties
-            streaming_agent.is_active = session_data.get('is_active', True)
-            streaming_agent.waiting_for_input = session_data.get('waiting_for_input', False)
-            streaming_agent.pending_input_prompt = session_data.get('pending_input_prompt', None)
-            
+            streaming_agent.waiting_for_input = session_data['waiting_for_input']
+            streaming_agent.pending_input_prompt = session_data['pending_input_prompt']
+
             active_sessions[session_id] = streaming_agent
-        
+
         return active_sessions
     except Exception as e:
         print(f"Error loading active sessions: {e}")
         return {}
 
 def save_active_sessions(sessions):
-    """Save active sessions to a pickle file"""
+    """Save active sessions and their agent state to the campaign store"""
     try:
-        # Prepare serializable data
-        sessions_data = {}
         for session_id, streaming_agent in sessions.items():
-            sessions_data[session_id] = {
-                'agent_state': streaming_agent.agent.state,
-                'is_active': streaming_agent.is_active,
-                'waiting_for_input': streaming_agent.waiting_for_input,
-                'pending_input_prompt': streaming_agent.pending_input_prompt
-            }
-        
-        with open(SESSIONS_FILE, 'wb') as f:
-            pickle.dump(sessions_data, f)
+            # An agent that never loaded its state would overwrite it with defaults
+            if streaming_agent.agent.state_loaded:
+                streaming_agent.save_state()
+            campaign_store.save_session(
+                session_id,
+                is_active=streaming_agent.is_active,
+                waiting_for_input=streaming_agent.waiting_for_input,
+                pending_input_prompt=streaming_agent.pending_input_prompt
+            )
     except Exception as e:
-        print(f"Error saving active sessions: {e}") 
+        print(f"Error saving active sessions: {e}")
 
 # Store active sessions
 active_sessions = load_active_sessions()
-print(f"Loaded {len(active_sessions)} active sessions from file.")
+print(f"Loaded {len(active_sessions)} active sessions from the campaign store.")
 
 @app.route('/')
 def index():
@@ -136,13 +296,16 @@ def start_session():
     else:
         session_id = str(uuid.uuid4())
     
-    # Create new streaming agent
+    # Create new streaming agent and load previous state if exists
     streaming_agent = StreamingAgent(session_id)
-    active_sessions[session_id] = streaming_agent
-    save_active_sessions(active_sessions)
-    
-    # Load previous state if exists
     streaming_agent.agent.load_state()
+    active_sessions[session_id] = streaming_agent
+    campaign_store.save_session(
+        session_id,
+        is_active=streaming_agent.is_active,
+        waiting_for_input=streaming_agent.waiting_for_input,
+        pending_input_prompt=streaming_agent.pending_input_prompt
+    )
     
     return jsonify({
         'session_id': session_id,
@@ -161,167 +324,26 @@ def send_message():
         return jsonify({'error': 'Invalid session ID'}), 400
     
     streaming_agent = active_sessions[session_id]
-    
-    # Add user message to stream
-    streaming_agent.add_message('user_message', message)
-    
-    # Check if we're waiting for input
-    if streaming_agent.waiting_for_input:
-        # This is a response to an input request
-        streaming_agent.waiting_for_input = False
-        streaming_agent.pending_input_prompt = None
-        
-        # Continue processing with the input
-        def continue_processing():
-            threading.current_thread().session_id = session_id
-            asyncio.run(continue_agent_processing(session_id, message))
-        
-        thread = threading.Thread(target=continue_processing)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'status': 'input_received', 'message': 'Continuing processing with your input'})
-    else:
-        # This is a new message - start processing
-        def process_message():
-            threading.current_thread().session_id = session_id
-            asyncio.run(process_agent_message(session_id, message))
-        
-        thread = threading.Thread(target=process_message)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'status': 'processing'})
 
-async def continue_agent_processing(session_id, user_input):
-    """Continue agent processing after receiving user input"""
-    if session_id not in active_sessions:
-        return
-        
-    streaming_agent = active_sessions[session_id]
-    agent = streaming_agent.agent
-    
+    # Clear the input request before the run starts, so a new request the run makes is not wiped
+    was_waiting = streaming_agent.waiting_for_input
+    pending_prompt = streaming_agent.pending_input_prompt
+    streaming_agent.waiting_for_input = False
+    streaming_agent.pending_input_prompt = None
     try:
-        # Load the saved state
-        agent.load_state()
-        
-        # Add the user input to conversation history
-        agent.state["conversation_history"].append({
-            "role": "user", 
-            "content": user_input
-        })
-        
-        agent.save_state()
-        
-        # Continue processing with empty input to let the agent continue
-        await process_agent_logic(session_id, streaming_agent, agent, "")
-        
-    except Exception as e:
-        streaming_agent.add_message('error', f'Error continuing processing: {str(e)}')
+        streaming_agent.start_run(message, user_message=message)
+    except (RuntimeFullError, RuntimeStoppedError) as e:
+        # The message was not taken; the agent still waits for it
+        streaming_agent.waiting_for_input = was_waiting
+        streaming_agent.pending_input_prompt = pending_prompt
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+    if was_waiting:
+        # This is a response to an input request; the run continues with it
+        return jsonify({'status': 'input_received', 'message': 'Continuing processing with your input'})
 
-async def process_agent_message(session_id, user_input):
-    """Process initial message with the agent"""
-    if session_id not in active_sessions:
-        return
-        
-    streaming_agent = active_sessions[session_id]
-    agent = streaming_agent.agent
-    
-    try:
-        # Process the message
-        await process_agent_logic(session_id, streaming_agent, agent, user_input)
-        
-    except Exception as e:
-        streaming_agent.add_message('error', f'Error processing message: {str(e)}')
-
-        
-async def process_agent_logic(session_id, streaming_agent, agent, user_input):
-    """Core agent processing logic"""
-    try:
-        response = await agent.get_ai_response(user_input)
-        
-        if response:
-            # Handle case where response is a string instead of dict
-            if isinstance(response, str):
-                streaming_agent.add_message('agent_response', response)
-                streaming_agent.add_message('completion', 'Task completed successfully!')
-                return
-            
-            # Send thought process
-            if response.get('thought'):
-                streaming_agent.add_message('agent_thought', response['thought'])
-            
-            # Send function call info and execute if present
-            if response.get('function_calls') and response['function_calls'].get('name'):
-                func_name = response['function_calls']['name']
-                func_inputs = response['function_calls'].get('inputs', {})
-                streaming_agent.add_message('function_call', {
-                    'name': func_name,
-                    'inputs': func_inputs
-                })
-                
-                # Execute the function
-                function_result = await agent.execute_function(func_name, func_inputs)
-                print(f"Function {func_name} executed with result: {function_result}")
-
-                # Check if we're waiting for input (for display_to_user_and_wait_for_input)
-                if func_name == "display_to_user_and_wait_for_input":
-                    streaming_agent.waiting_for_input = True
-                    streaming_agent.pending_input_prompt = function_result
-                    streaming_agent.add_message('function_result', function_result)
-                    streaming_agent.add_message('input_request', 'Waiting for your input to continue...')
-                    return
-                
-                streaming_agent.add_message('function_result', function_result)
-            
-            # Continue processing if there are more function calls
-            max_iterations = 10  # Prevent infinite loops
-            iteration = 0
-            while (response and 
-                   isinstance(response, dict) and  # Add type check here
-                   response.get('function_calls') and 
-                   response['function_calls'].get('name') and 
-                   not streaming_agent.waiting_for_input and
-                   iteration < max_iterations):
-                
-                iteration += 1
-                response = await agent.get_ai_response("")
-                
-                if response:
-                    # Handle string response in the loop too
-                    if isinstance(response, str):
-                        streaming_agent.add_message('agent_response', response)
-                        break
-                    
-                    if response.get('thought'):
-                        streaming_agent.add_message('agent_thought', response['thought'])
-                    
-                    if response.get('function_calls') and response['function_calls'].get('name'):
-                        func_name = response['function_calls']['name']
-                        func_inputs = response['function_calls'].get('inputs', {})
-                        streaming_agent.add_message('function_call', {
-                            'name': func_name,
-                            'inputs': func_inputs
-                        })
-                        
-                        # Execute the function
-                        function_result = await agent.execute_function(func_name, func_inputs)
-                        
-                        # Check if we're waiting for input
-                        if func_name == "display_to_user_and_wait_for_input":
-                            streaming_agent.waiting_for_input = True
-                            streaming_agent.pending_input_prompt = function_result
-                            streaming_agent.add_message('info', 'Waiting for your input to continue...')
-                            return
-                        
-                        streaming_agent.add_message('function_result', function_result)
-        
-        # Send completion message if not waiting for input
-        if not streaming_agent.waiting_for_input:
-            streaming_agent.add_message('completion', 'Task completed successfully!')
-        
-    except Exception as e:
-        streaming_agent.add_message('error', f'Error in agent logic: {str(e)}')
+    # This is a new message - start processing
+    return jsonify({'status': 'processing'})
 
 @app.route('/stream/<session_id>')
 def stream_messages(session_id):
@@ -330,10 +352,14 @@ def stream_messages(session_id):
         return Response('Invalid session', status=400)
     
     streaming_agent = active_sessions[session_id]
+
+    # Sent by the browser when EventSource reconnects
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
     
     def generate():
         yield "data: {\"type\": \"connected\", \"message\": \"Stream connected\"}\n\n"
-        for message in streaming_agent.get_messages():
+        for message in streaming_agent.get_messages(last_event_id=last_event_id):
             yield message
     
     return Response(generate(), 
@@ -359,10 +385,10 @@ def get_state(session_id):
 def end_session(session_id):
     """End an agent session"""
     if session_id in active_sessions:
-        active_sessions[session_id].is_active = False
-        active_sessions[session_id].agent.save_state()
+        active_sessions[session_id].close()
+        active_sessions[session_id].save_state(compact=True)
+        campaign_store.save_session(session_id, is_active=False)
         del active_sessions[session_id]
-        save_active_sessions(active_sessions)
         return jsonify({'status': 'ended'})
     
     return jsonify({'error': 'Invalid session ID'}), 400
@@ -383,15 +409,35 @@ def get_summary(session_id):
         'outreach_messages': len(state.get('outreach_messages', {})),
         'meetings_scheduled': len(state.get('scheduled_meetings', [])),
         'errors': len(state.get('errors', [])),
-        'function_calls': len(state.get('function_call_history', []))
+        'function_calls': len(state.get('function_call_history', [])),
+        'candidate_dedup': agent.candidate_store.stats(),
+        'stream': active_sessions[session_id].hub.stats()
     }
     
     return jsonify(summary)
 
+@app.route('/get_metrics')
+def get_metrics():
+    """Get process-wide performance counters"""
+    return jsonify({
+        'llm_cache': llm_cache.stats() if llm_cache else None,
+        'singleflight': {
+            'llm': llm_flight.stats(),
+            'tools': tool_flight.stats()
+        },
+        'bedrock_limiter': bedrock_limiter.stats(),
+        'llm_usage': usage_stats(),
+        'tool_pools': tool_pool_stats(),
+        'tools': tool_registry.stats(),
+        'agent_steps': agent_step_stats(),
+        'agent_runtime': agent_runtime.stats(),
+        'streams': stream_stats()
+    })
+
 
 @app.route('/save_oauth_credentials/<session_id>', methods=['POST'])
 def save_oauth_credentials(session_id):
-    """Receive and store user OAuth credentials in a JSON file"""
+    """Receive and store user OAuth credentials in the campaign store"""
     data = request.get_json()
     print(data)
     credentials = data.get('credentials')
@@ -409,14 +455,55 @@ def save_oauth_credentials(session_id):
         "credentials": credentials,
     }
 
-    # Save credentials to a file named by session_id
     try:
-        with open(f'creds/creds_{session_id}.json', 'w') as f:
-            json.dump(final_data, f)
+        campaign_store.save_credentials(session_id, final_data["email"], final_data["credentials"])
         return jsonify({'status': 'success', 'message': 'Credentials saved'})
     except Exception as e:
         return jsonify({'error': f'Failed to save credentials: {str(e)}'}), 500
 
+def add_follow_ups(agent, session_id, mails, credentials):
+    """
+    Record new follow-up mails and add them to the agent's conversation.
+
+    Runs as the first part of the session's agent job, so it never races a run of the
+    same session. mails are (message_id, thread_id, subject, body) tuples. Returns
+    False when every mail was already handled.
+    """
+    mails_received = []
+    for message_id, thread_id, subject, body in mails:
+        mark_message_as_read(message_id, credentials)
+
+        # Skip notifications for mails that were already handled
+        if campaign_store.record_follow_up(session_id, thread_id, message_id, subject, body):
+            mails_received.append(f"Subject: {subject}\nContent: {body}\n\n")
+
+    if not mails_received:
+        return False
+
+    mails_received_prompt = "From the emails you have sent, you have received the following follow-up emails:\n\n"
+    mails_received_prompt += "".join(mails_received)
+    mails_received_prompt += "\nPlease analyze these follow-up emails and determine the appropriate response or next steps.\n\n"
+
+    # Load the current state
+    agent.load_state()
+
+    # Add to conversation history
+    agent.state["conversation_history"].append({
+        "role": "user",
+        "content": mails_received_prompt
+    })
+
+    # Also track the follow-up in a separate field
+    if "followup_emails" not in agent.state:
+        agent.state["followup_emails"] = []
+
+    agent.state["followup_emails"].extend(mails_received)
+
+    agent.save_state()
+
+    # The prompt is now in the history; the run just lets the agent respond
+    return True
+
 @app.route('/followup_email', methods=['POST'])
 def followup_email():
     """Handle incoming follow-up emails and continue agent conversation"""
@@ -426,18 +513,7 @@ def followup_email():
     print(f"Received follow-up emails")
     
     # might not be the right session_id, in case multiple sessions share the same email but the credentials would be the same and therefore can be used here
-    credentials = None
-    for file_name in os.listdir('creds'):
-        session_id =  file_name.split('_')[-1].replace('.json', '')
-        with open (f'creds/{file_name}', 'r') as f:
-            try:
-                json_data = json.load(f)
-                if json_data.get('email') == email_address:
-                    credentials = json_data.get('credentials')
-                    break
-            except json.JSONDecodeError as e:
-                print(f"Error reading JSON from {file_name}: {e}")
-                continue
+    credentials = campaign_store.credentials_for_email(email_address)
         
     if not credentials:
         return jsonify({'message': 'Mail isn\'t a follow up mail'}), 200
@@ -464,22 +540,7 @@ def followup_email():
         thread_id = email["threadId"]   
 
         # now we have to find the session_id based on the thread_id
-        session_id_final = None
-
-        for file_name in os.listdir('creds'):
-            session_id = file_name.split('_')[-1].replace('.json', '')
-
-            with open(f'creds/{file_name}', 'r') as f:
-                try:
-                    json_data = json.load(f)
-                    thread_ids_sent = json_data.get('thread_ids_sent', [])
-                    if thread_ids_sent and thread_id in thread_ids_sent:
-                        session_id_final = session_id
-                        break
-                except json.JSONDecodeError as e:
-                    print(f"Error reading JSON from {file_name}: {e}")
-                    continue   
-
+        session_id_final = campaign_store.session_for_thread(thread_id)
 
         if not session_id_final:
             continue
@@ -495,57 +556,32 @@ def followup_email():
 
     session_ids = list(sessions.keys())  # Convert to list for JSON serialization
 
+    rejected = []
     for session_id in session_ids:
-        agent = active_sessions[session_id].agent
-
-        mails_received_prompt = "From the emails you have sent, you have received the following follow-up emails:\n\n"
-
-        mails_received = []
+        if session_id not in active_sessions:
+            continue
 
+        mails = []
         for message_id, thread_id in sessions[session_id]:
-            
             subject, body = extract_mail_details_from_message_id(message_id, credentials)
-
-            mark_message_as_read(message_id, credentials)
-
-            mails_received.append(f"Subject: {subject}\nContent: {body}\n\n")
-
             print(f"Extracted subject: {subject}, body: {body}")
-
-            mails_received_prompt += f"Subject: {subject}\nContent: {body}\n\n"
-
-        mails_received_prompt += "\nPlease analyze these follow-up emails and determine the appropriate response or next steps.\n\n"
+            mails.append((message_id, thread_id, subject, body))
 
         try:
-            # Load the current state
-            agent.load_state()
-            
-            # Add to conversation history
-            agent.state["conversation_history"].append({
-                "role": "user", 
-                "content": mails_received_prompt
-            })
-            
-            # Also track the follow-up in a separate field
-            if "followup_emails" not in agent.state:
-                agent.state["followup_emails"] = []
-            
-            agent.state["followup_emails"].extend(mails_received)
-            
-            agent.save_state()
-
-            def process_message():
-                threading.current_thread().session_id = session_id
-                asyncio.run(process_agent_logic(session_id, active_sessions[session_id], agent, mails_received_prompt))
-            
-            thread = threading.Thread(target=process_message)
-            thread.daemon = True
-            thread.start()
-            
-        except Exception as e:
-            active_sessions[session_id].add_message('error', f'Error processing follow-up email: {str(e)}') 
+            # The run records the mails and adds them to the conversation itself, so a
+            # rejected run leaves them unread and unrecorded for Pub/Sub to redeliver
+            streaming_agent = active_sessions[session_id]
+            streaming_agent.start_run("", prepare=partial(add_follow_ups, streaming_agent.agent, session_id, mails, credentials))
+        except (RuntimeFullError, RuntimeStoppedError) as e:
+            print(f"❌ Follow-up emails for session {session_id} not accepted: {str(e)}")
+            rejected.append(session_id)
+
+    if rejected:
+        return jsonify({
+            'error': 'Agent runtime is busy; retry the notification later',
+            'session_ids': rejected
+        }), 503, {'Retry-After': '5'}
 
-        
     return jsonify({
         'status': 'processing_followup',
         'session_ids': session_ids,
@@ -553,5 +589,24 @@ def followup_email():
     })
 
 
+# Let queued and running agent jobs finish when the server stops
+atexit.register(agent_runtime.shutdown)
+
+_previous_sigterm_handler = None
+
+def drain_on_sigterm(signum, frame):
+    """atexit does not run when the process is killed by SIGTERM; drain the agent runtime first"""
+    print("🛑 SIGTERM received, draining agent runs...")
+    agent_runtime.shutdown()
+    save_active_sessions(active_sessions)
+    if callable(_previous_sigterm_handler):
+        _previous_sigterm_handler(signum, frame)
+    else:
+        sys.exit(0)
+
+# Signal handlers can only be installed from the main thread
+if threading.current_thread() is threading.main_thread():
+    _previous_sigterm_handler = signal.signal(signal.SIGTERM, drain_on_sigterm)
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5050, threaded=True)
@@ -0,0 +1,376 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CAMPAIGN_DB_PATH = os.getenv("CAMPAIGN_DB_PATH", "campaign.sqlite3")
+CAMPAIGN_DB_BUSY_TIMEOUT_MS = int(os.getenv("CAMPAIGN_DB_BUSY_TIMEOUT_MS", "5000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    email TEXT,
+    credentials TEXT,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    waiting_for_input INTEGER NOT NULL DEFAULT 0,
+    pending_input_prompt TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_email ON sessions (email);
+CREATE INDEX IF NOT EXISTS idx_sessions_active ON sessions (is_active);
+
+CREATE TABLE IF NOT EXISTS state_snapshots (
+    session_id TEXT PRIMARY KEY,
+    journal_seq INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS state_journal (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS candidates (
+    session_id TEXT NOT NULL,
+    candidate_id TEXT NOT NULL,
+    name TEXT,
+    source TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (session_id, candidate_id)
+);
+
+CREATE TABLE IF NOT EXISTS scores (
+    session_id TEXT NOT NULL,
+    candidate_id TEXT NOT NULL,
+    score REAL NOT NULL,
+    method TEXT,
+    reasoning TEXT,
+    data TEXT NOT NULL,
+    scored_at REAL NOT NULL,
+    PRIMARY KEY (session_id, candidate_id)
+);
+CREATE INDEX IF NOT EXISTS idx_scores_rank ON scores (session_id, score DESC);
+
+CREATE TABLE IF NOT EXISTS outreach_messages (
+    session_id TEXT NOT NULL,
+    message_key TEXT NOT NULL,
+    candidate_id TEXT,
+    recipient TEXT,
+    subject TEXT,
+    body TEXT,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, message_key)
+);
+CREATE INDEX IF NOT EXISTS idx_outreach_candidate ON outreach_messages (session_id, candidate_id);
+
+CREATE TABLE IF NOT EXISTS sent_threads (
+    thread_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    recipient TEXT,
+    subject TEXT,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sent_threads_session ON sent_threads (session_id);
+
+CREATE TABLE IF NOT EXISTS follow_ups (
+    message_id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    subject TEXT,
+    body TEXT,
+    received_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_follow_ups_session ON follow_ups (session_id, received_at);
+CREATE INDEX IF NOT EXISTS idx_follow_ups_thread ON follow_ups (thread_id);
+"""
+
+
+class CampaignStore:
+    """
+    Embedded SQLite store for campaign data: sessions and their credentials, agent
+    state (snapshot + journal), candidates, scores, outreach messages, sent threads
+    and follow-up emails.
+
+    Runs in WAL mode with one connection per thread, so readers never block the
+    writer and concurrent writers queue on the busy timeout instead of overwriting
+    each other's files.
+    """
+
+    def __init__(self, path=CAMPAIGN_DB_PATH, busy_timeout_ms=CAMPAIGN_DB_BUSY_TIMEOUT_MS):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.conn = conn
+        return conn
+
+    # Sessions
+
+    def save_session(self, session_id, is_active=None, waiting_for_input=None, pending_input_prompt=None):
+        """Create the session row if needed and update the given fields"""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, created_at, updated_at) VALUES (?, ?, ?)",
+                (session_id, now, now)
+            )
+            conn.execute(
+                """UPDATE sessions SET
+                    is_active = COALESCE(?, is_active),
+                    waiting_for_input = COALESCE(?, waiting_for_input),
+                    pending_input_prompt = CASE WHEN ? THEN ? ELSE pending_input_prompt END,
+                    updated_at = ?
+                WHERE session_id = ?""",
+                (
+                    None if is_active is None else int(is_active),
+                    None if waiting_for_input is None else int(waiting_for_input),
+                    waiting_for_input is not None, pending_input_prompt,
+                    now, session_id
+                )
+            )
+
+    def active_sessions(self):
+        """Rows of the sessions that are still active"""
+        rows = self._conn().execute(
+            "SELECT session_id, waiting_for_input, pending_input_prompt FROM sessions WHERE is_active = 1"
+        ).fetchall()
+        return [
+            {"session_id": row[0], "waiting_for_input": bool(row[1]), "pending_input_prompt": row[2]}
+            for row in rows
+        ]
+
+    def save_credentials(self, session_id, email, credentials):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                """INSERT INTO sessions (session_id, email, credentials, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    email = excluded.email, credentials = excluded.credentials, updated_at = excluded.updated_at""",
+                (session_id, email, json.dumps(credentials), now, now)
+            )
+
+    def get_credentials(self, session_id):
+        row = self._conn().execute(
+            "SELECT credentials FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def credentials_for_email(self, email):
+        """Credentials of the most recently updated session connected to this mailbox"""
+        row = self._conn().execute(
+            "SELECT credentials FROM sessions WHERE email = ? AND credentials IS NOT NULL ORDER BY updated_at DESC LIMIT 1",
+            (email,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Agent state (SessionJournal storage)
+
+    def journal_storage(self, session_id):
+        return SQLiteJournalStorage(self, session_id)
+
+    # Candidates, scores and outreach
+
+    def save_candidates(self, session_id, candidates):
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                """INSERT INTO candidates (session_id, candidate_id, name, source, data, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (session_id, candidate_id) DO UPDATE SET
+                    name = excluded.name, source = excluded.source,
+                    data = excluded.data, updated_at = excluded.updated_at""",
+                [
+                    (
+                        session_id, candidate["candidate_id"],
+                        candidate.get("name") or candidate.get("channel_name"), candidate.get("source"),
+                        json.dumps(candidate, default=str), now
+                    )
+                    for candidate in candidates if candidate.get("candidate_id")
+                ]
+            )
+
+    def save_scores(self, session_id, scored_candidates, method=None):
+        """Record the latest score of each scored candidate; a candidate's own score_method wins over method"""
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO scores (session_id, candidate_id, score, method, reasoning, data, scored_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                [
+                    (
+                        session_id, candidate["candidate_id"], float(candidate.get("ai_score", 0)),
+                        candidate.get("score_method") or method,
+                        candidate.get("ai_reasoning"),
+                        json.dumps({
+                            "strengths": candidate.get("ai_strengths", []),
+                            "concerns": candidate.get("ai_concerns", [])
+                        }),
+                        now
+                    )
+                    for candidate in scored_candidates if candidate.get("candidate_id")
+                ]
+            )
+
+    def top_scored(self, session_id, limit=10):
+        """Best scored candidates of a session, highest first"""
+        rows = self._conn().execute(
+            """SELECT c.data, s.score FROM scores s
+            JOIN candidates c ON c.session_id = s.session_id AND c.candidate_id = s.candidate_id
+            WHERE s.session_id = ? ORDER BY s.score DESC LIMIT ?""",
+            (session_id, limit)
+        ).fetchall()
+        return [dict(json.loads(data), ai_score=score) for data, score in rows]
+
+    def save_outreach_messages(self, session_id, outreach_messages):
+        now = time.time()
+        rows = []
+        for key, message in outreach_messages.items():
+            candidate = message.get("candidate") or {}
+            rows.append((
+                session_id, key, candidate.get("candidate_id"), message.get("candidate_email"),
+                message.get("subject"), message.get("body"), json.dumps(message, default=str), now
+            ))
+        with self._conn() as conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO outreach_messages
+                (session_id, message_key, candidate_id, recipient, subject, body, data, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows
+            )
+
+    # Sent threads and follow-ups
+
+    def record_sent_thread(self, session_id, thread_id, recipient=None, subject=None):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sent_threads (thread_id, session_id, recipient, subject, sent_at) VALUES (?, ?, ?, ?, ?)",
+                (thread_id, session_id, recipient, subject, time.time())
+            )
+
+    def session_for_thread(self, thread_id):
+        """The session that sent this email thread, or None"""
+        row = self._conn().execute(
+            "SELECT session_id FROM sent_threads WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def record_follow_up(self, session_id, thread_id, message_id, subject, body):
+        """
+        Store a received follow-up email.
+
+        Returns False if this message was already recorded (e.g. a redelivered notification).
+        """
+        with self._conn() as conn:
+            cursor = conn.execute(
+                """INSERT OR IGNORE INTO follow_ups (message_id, thread_id, session_id, subject, body, received_at)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (message_id, thread_id, session_id, subject, body, time.time())
+            )
+            return cursor.rowcount > 0
+
+    def follow_ups(self, session_id):
+        rows = self._conn().execute(
+            "SELECT message_id, thread_id, subject, body, received_at FROM follow_ups WHERE session_id = ? ORDER BY received_at",
+            (session_id,)
+        ).fetchall()
+        return [
+            {"message_id": row[0], "thread_id": row[1], "subject": row[2], "body": row[3], "received_at": row[4]}
+            for row in rows
+        ]
+
+    # Migration from the file layout
+
+    def import_legacy_files(self, creds_dir="creds"):
+        """
+        Import credentials and sent thread IDs from creds/creds_<session_id>.json files.
+
+        Existing rows win, so this is safe to run on every start.
+        """
+        if not os.path.isdir(creds_dir):
+            return 0
+        imported = 0
+        for file_name in os.listdir(creds_dir):
+            if not (file_name.startswith("creds_") and file_name.endswith(".json")):
+                continue
+            session_id = file_name[len("creds_"):-len(".json")]
+            try:
+                with open(os.path.join(creds_dir, file_name), "r") as f:
+                    json_data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Error reading {file_name}: {e}")
+                continue
+            if self.get_credentials(session_id) is None and json_data.get("credentials"):
+                self.save_credentials(session_id, json_data.get("email"), json_data["credentials"])
+                imported += 1
+            for thread_id in json_data.get("thread_ids_sent", []):
+                self.record_sent_thread(session_id, thread_id)
+        return imported
+
+    def stats(self):
+        conn = self._conn()
+        counts = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("sessions", "candidates", "scores", "outreach_messages", "sent_threads", "follow_ups", "state_journal")
+        }
+        counts["path"] = self.path
+        return counts
+
+
+class SQLiteJournalStorage:
+    """SessionJournal storage in the campaign store; snapshot and truncation commit atomically"""
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    def append(self, ops):
+        rows = [(self.session_id, op["seq"], json.dumps(op)) for op in ops]
+        with self.store._conn() as conn:
+            conn.executemany("INSERT OR REPLACE INTO state_journal (session_id, seq, op) VALUES (?, ?, ?)", rows)
+        return sum(len(row[2]) for row in rows)
+
+    def write_snapshot(self, state, seq):
+        with self.store._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO state_snapshots (session_id, journal_seq, state, updated_at) VALUES (?, ?, ?, ?)",
+                (self.session_id, seq, json.dumps(state), time.time())
+            )
+            conn.execute("DELETE FROM state_journal WHERE session_id = ? AND seq <= ?", (self.session_id, seq))
+
+    def read_snapshot(self):
+        row = self.store._conn().execute(
+            "SELECT state, journal_seq FROM state_snapshots WHERE session_id = ?", (self.session_id,)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, 0)
+
+    def read_ops(self, after_seq):
+        rows = self.store._conn().execute(
+            "SELECT op FROM state_journal WHERE session_id = ? AND seq > ? ORDER BY seq",
+            (self.session_id, after_seq)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+# Shared process-wide store
+campaign_store = CampaignStore()
@@ -0,0 +1,236 @@
+import re
+import zlib
+from itertools import chain
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Candidate fields that may hold an audience size, in order of preference
+AUDIENCE_FIELDS = ["subscribers", "subscriber_count", "total_subscribers", "followers"]
+
+# Fields that describe a candidate, used for keyword relevance
+TEXT_FIELDS = ["name", "channel_name", "title", "description", "sample_content", "recent_videos"]
+
+AUDIENCE_SUFFIXES = {"k": 1e3, "m": 1e6, "b": 1e9}
+
+
+def parse_audience_count(value):
+    """
+    Parse audience sizes such as 12000, "12,000", "1.2M" or "3.4K" into a number.
+
+    Hidden or unparseable counts return 0.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return 0.0
+    text = value.strip().lower().replace(",", "")
+    multiplier = AUDIENCE_SUFFIXES.get(text[-1:], 1.0)
+    if multiplier != 1.0:
+        text = text[:-1]
+    try:
+        return float(text) * multiplier
+    except ValueError:
+        return 0.0
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def candidate_text(candidate):
+    """Searchable text of a candidate"""
+    parts = []
+    for field in TEXT_FIELDS:
+        value = candidate.get(field)
+        if isinstance(value, list):
+            parts.extend(str(item) for item in value)
+        elif value:
+            parts.append(str(value))
+    return " ".join(parts)
+
+
+def candidate_audience(candidate):
+    for field in AUDIENCE_FIELDS:
+        if candidate.get(field) not in (None, ""):
+            return parse_audience_count(candidate[field])
+    return 0.0
+
+
+class BM25Index:
+    """
+    BM25 index over a list of documents.
+
+    Postings are stored as NumPy arrays sorted by term, so scoring a query touches
+    only the postings of its terms and accumulates them in one vectorized pass.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        tokenized = [tokenize(document) for document in documents]
+        self.num_docs = len(documents)
+        self.doc_lengths = np.fromiter((len(tokens) for tokens in tokenized), dtype=np.float64, count=self.num_docs)
+        self.avg_doc_length = self.doc_lengths.mean() if self.doc_lengths.sum() else 1.0
+
+        # Map tokens to term ids in one pass over the flattened corpus
+        self.vocabulary = {}
+        term_ids = np.fromiter(
+            (self.vocabulary.setdefault(token, len(self.vocabulary)) for tokens in tokenized for token in tokens),
+            dtype=np.int64
+        )
+        doc_ids = np.repeat(np.arange(self.num_docs, dtype=np.int64), self.doc_lengths.astype(np.int64))
+
+        # Collapse (term, doc) pairs into term frequencies, sorted by term
+        width = max(self.num_docs, 1)
+        unique_pairs, term_frequencies = np.unique(term_ids * width + doc_ids, return_counts=True)
+        self.posting_terms = unique_pairs // width
+        self.posting_docs = unique_pairs % width
+        self.posting_tf = term_frequencies.astype(np.float64)
+
+        # Posting list boundaries and IDF per term
+        num_terms = len(self.vocabulary)
+        self.offsets = np.searchsorted(self.posting_terms, np.arange(num_terms + 1))
+        document_frequency = np.diff(self.offsets).astype(np.float64)
+        self.idf = np.log(1 + (self.num_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def score(self, query):
+        """BM25 score of every document for the query, as a float array"""
+        scores = np.zeros(self.num_docs, dtype=np.float64)
+        term_ids = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not term_ids:
+            return scores
+
+        slices = [np.arange(self.offsets[t], self.offsets[t + 1]) for t in term_ids]
+        postings = np.concatenate(slices)
+        docs = self.posting_docs[postings]
+        tf = self.posting_tf[postings]
+        idf = self.idf[self.posting_terms[postings]]
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_doc_length)
+        np.add.at(scores, docs, idf * tf * (self.k1 + 1) / (tf + norm))
+        return scores
+
+
+def score_candidate_pool(candidates, user_query):
+    """
+    Score a candidate pool without the LLM.
+
+    Combines BM25 relevance of name/description/videos to the query (up to 60 points)
+    with log-scaled audience size (up to 20 points, 1M+ scores full) on top of a base
+    of 20, capped at 100.
+
+    Returns:
+        Tuple of (scores array, relevance array in [0, 1], audience array)
+    """
+    index = BM25Index([candidate_text(candidate) for candidate in candidates])
+    relevance = index.score(user_query)
+    if relevance.size and relevance.max() > 0:
+        relevance = relevance / relevance.max()
+
+    audience = np.fromiter((candidate_audience(candidate) for candidate in candidates), dtype=np.float64, count=len(candidates))
+    audience_score = np.clip(np.log10(audience + 1) / 6, 0, 1)
+
+    scores = np.minimum(20 + 60 * relevance + 20 * audience_score, 100)
+    return np.round(scores, 1), relevance, audience
+
+
+# Hashed n-gram space for the offline pre-filter
+HASH_DIMENSIONS = 2 ** 18
+CHAR_NGRAM = 3
+
+
+def hashed_features(text):
+    """
+    Hashed feature IDs of a text: its words plus character trigrams of each word,
+    so "podcaster" still overlaps "podcast" and word order does not matter.
+
+    crc32 keeps the buckets stable across processes, unlike hash().
+    """
+    features = []
+    for token in tokenize(text):
+        features.append(zlib.crc32(token.encode()) % HASH_DIMENSIONS)
+        padded = f"#{token}#"
+        for i in range(len(padded) - CHAR_NGRAM + 1):
+            features.append(zlib.crc32(padded[i:i + CHAR_NGRAM].encode()) % HASH_DIMENSIONS)
+    return features
+
+
+def hashed_feature_pairs(texts):
+    """
+    (doc_ids, buckets): the hashed_features of every text, flattened for the whole pool.
+
+    Each distinct word is hashed once; documents then gather their words' features
+    with NumPy, so the cost grows with the vocabulary rather than with every
+    trigram of every document.
+    """
+    tokenized = [tokenize(text) for text in texts]
+    token_counts = np.fromiter((len(tokens) for tokens in tokenized), dtype=np.int64, count=len(texts))
+    vocabulary = {word: i for i, word in enumerate(dict.fromkeys(chain.from_iterable(tokenized)))}
+    word_ids = np.fromiter(
+        map(vocabulary.__getitem__, chain.from_iterable(tokenized)), dtype=np.int64, count=int(token_counts.sum())
+    )
+
+    word_features = [hashed_features(word) for word in vocabulary]
+    feature_counts = np.fromiter((len(f) for f in word_features), dtype=np.int64, count=len(word_features))
+    flat_features = np.fromiter(chain.from_iterable(word_features), dtype=np.int64, count=int(feature_counts.sum()))
+    word_starts = np.cumsum(feature_counts) - feature_counts
+
+    # For each token occurrence, the slice of flat_features holding its word's features
+    token_feature_counts = feature_counts[word_ids]
+    token_ends = np.cumsum(token_feature_counts)
+    positions = np.arange(int(token_ends[-1]) if len(token_ends) else 0, dtype=np.int64)
+    positions += np.repeat(word_starts[word_ids] - (token_ends - token_feature_counts), token_feature_counts)
+
+    doc_ids = np.repeat(np.repeat(np.arange(len(texts), dtype=np.int64), token_counts), token_feature_counts)
+    return doc_ids, flat_features[positions]
+
+
+def query_similarity(candidates, user_query):
+    """
+    Cosine similarity between the query and each candidate's hashed n-gram vector.
+
+    Uses sublinear term frequency; the whole pool is scored in one vectorized pass.
+    """
+    query_vector = np.zeros(HASH_DIMENSIONS, dtype=np.float64)
+    query_buckets, query_counts = np.unique(np.asarray(hashed_features(user_query), dtype=np.int64), return_counts=True)
+    query_vector[query_buckets] = 1 + np.log(query_counts)
+    query_norm = np.linalg.norm(query_vector)
+
+    similarity = np.zeros(len(candidates), dtype=np.float64)
+    if not query_norm:
+        return similarity
+    doc_ids, buckets = hashed_feature_pairs([candidate_text(candidate) for candidate in candidates])
+    if not len(buckets):
+        return similarity
+
+    pairs, counts = np.unique(doc_ids * HASH_DIMENSIONS + buckets, return_counts=True)
+    pair_docs, pair_buckets = pairs // HASH_DIMENSIONS, pairs % HASH_DIMENSIONS
+    weights = 1 + np.log(counts)
+
+    dot = np.bincount(pair_docs, weights=weights * query_vector[pair_buckets], minlength=len(candidates))
+    norms = np.sqrt(np.bincount(pair_docs, weights=weights ** 2, minlength=len(candidates)))
+    np.divide(dot, norms * query_norm, out=similarity, where=norms > 0)
+    return similarity
+
+
+def prefilter_candidates(candidates, user_query, top_k, min_similarity=0.0, min_kept=0):
+    """
+    Pick the candidates worth sending to the LLM.
+
+    Keeps at most top_k candidates, most similar first, and drops any below
+    min_similarity. If fewer than min_kept pass the threshold (sparse records, a
+    query in another language), the threshold is ignored and the top_k most
+    similar are kept.
+
+    Returns:
+        Tuple of (kept indexes in original order, dropped indexes most similar first,
+        similarity array)
+    """
+    similarity = query_similarity(candidates, user_query)
+    order = np.argsort(-similarity, kind="stable")
+    kept = [int(i) for i in order[:top_k] if similarity[i] >= min_similarity]
+    if len(kept) < min(min_kept, len(candidates)):
+        kept = [int(i) for i in order[:top_k]]
+    kept_set = set(kept)
+    dropped = [int(i) for i in order if int(i) not in kept_set]
+    return sorted(kept), dropped, similarity
@@ -0,0 +1,189 @@
+import re
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+YOUTUBE_CHANNEL_PATTERN = re.compile(r"youtube\.com/channel/([A-Za-z0-9_-]+)")
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
+# Fields that hold a URL identifying the candidate, in order of preference
+URL_FIELDS = ["channel_url", "url", "website", "about_url"]
+
+# Query parameters that only track the referrer, not the page
+TRACKING_PARAMS = {"ref", "fbclid", "gclid", "si", "feature"}
+
+# Trailing path segments that point at the same page as their parent
+URL_SUFFIXES = ("/about", "/featured", "/videos", "/index.html")
+
+
+def normalize_url(url):
+    """
+    Reduce a URL to host, path and meaningful query, e.g.
+    "https://www.Example.com/Blog/?ref=x" -> "example.com/blog".
+    """
+    if not url:
+        return None
+    parts = urlsplit(url if "//" in url else f"//{url}")
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if host.startswith("m."):
+        host = host[2:]
+    if not host:
+        return None
+    path = parts.path.lower().rstrip("/")
+    for suffix in URL_SUFFIXES:
+        if path.endswith(suffix):
+            path = path[:-len(suffix)]
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query)
+        if name.lower() not in TRACKING_PARAMS and not name.lower().startswith("utm_")
+    )
+    return host + path + (f"?{urlencode(query)}" if query else "")
+
+
+def canonical_keys(candidate):
+    """
+    Identity keys of a candidate: YouTube channel ID, normalized URLs and email.
+
+    Two candidates sharing any key are the same person or channel.
+    """
+    keys = []
+    for field in URL_FIELDS:
+        url = candidate.get(field)
+        if not isinstance(url, str) or not url:
+            continue
+        channel = YOUTUBE_CHANNEL_PATTERN.search(url)
+        if channel:
+            keys.append(f"youtube:{channel.group(1)}")
+        normalized = normalize_url(url)
+        if normalized:
+            keys.append(f"url:{normalized}")
+
+    email = candidate.get("email")
+    if isinstance(email, str) and EMAIL_PATTERN.fullmatch(email.strip()):
+        keys.append(f"email:{email.strip().lower()}")
+
+    # Preserve order, drop duplicates (channel_url and about_url normalize alike)
+    return list(dict.fromkeys(keys))
+
+
+def merge_candidate(existing, incoming):
+    """
+    Merge a repeated sighting into the stored candidate in place.
+
+    Empty fields are filled, lists are unioned, and existing values win otherwise.
+    Returns the names of the fields that changed.
+    """
+    changed = []
+    for field, value in incoming.items():
+        if field in ("candidate_id", "search_id"):
+            continue
+        current = existing.get(field)
+        if current in (None, "", [], {}, "Hidden"):
+            if value not in (None, "", [], {}):
+                existing[field] = value
+                changed.append(field)
+        elif isinstance(current, list) and isinstance(value, list):
+            extra = [item for item in value if item not in current]
+            if extra:
+                existing[field] = current + extra
+                changed.append(field)
+    return changed
+
+
+class CandidateStore:
+    """
+    Deduplicating view over the agent's candidate list.
+
+    Candidates are keyed by canonical identity (see canonical_keys) with a hash index
+    from key to candidate ID, so repeated sightings across searches merge into one
+    entry instead of appending duplicates. Works directly on the JSON-serializable
+    list and stats dict kept in agent state, so it can be rebuilt after load_state.
+    """
+
+    def __init__(self, candidates, stats=None):
+        self.candidates = candidates
+        self.stats_counts = stats if stats is not None else {}
+        for name in ("sightings", "added", "merged", "fields_merged"):
+            self.stats_counts.setdefault(name, 0)
+        self.stats_counts.setdefault("merged_by_key", {})
+        self._by_id = {}
+        self._positions = {}
+        self._index = {}
+        for position, candidate in enumerate(candidates):
+            self._index_candidate(candidate, position)
+
+    def _index_candidate(self, candidate, position=None):
+        candidate_id = candidate.get("candidate_id")
+        if candidate_id is None:
+            return
+        self._by_id[candidate_id] = candidate
+        if position is not None:
+            self._positions[candidate_id] = position
+        for key in canonical_keys(candidate):
+            self._index.setdefault(key, candidate_id)
+
+    def __contains__(self, candidate):
+        return self.find(candidate) is not None
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def get(self, candidate_id):
+        return self._by_id.get(candidate_id)
+
+    def position(self, candidate_id):
+        """Index of the candidate in the underlying list"""
+        return self._positions.get(candidate_id)
+
+    def find(self, candidate):
+        """(stored candidate, matching key) for the first shared identity key, or None"""
+        for key in canonical_keys(candidate):
+            if key in self._index:
+                return self._by_id[self._index[key]], key
+        return None
+
+    def add(self, candidate, candidate_id):
+        """
+        Add a candidate, or merge it into an existing one with the same identity.
+
+        Args:
+            candidate: Normalized candidate dict
+            candidate_id: ID to assign if the candidate is new
+
+        Returns:
+            Tuple of (stored candidate, whether it was merged into an existing entry)
+        """
+        self.stats_counts["sightings"] += 1
+        match = self.find(candidate)
+        if match is None:
+            candidate["candidate_id"] = candidate_id
+            candidate["sightings"] = 1
+            self.candidates.append(candidate)
+            self._index_candidate(candidate, len(self.candidates) - 1)
+            self.stats_counts["added"] += 1
+            return candidate, False
+
+        existing, key = match
+        changed = merge_candidate(existing, candidate)
+        existing["sightings"] = existing.get("sightings", 1) + 1
+        # Index keys only the new sighting carried (e.g. a URL alongside a known channel ID)
+        for new_key in canonical_keys(candidate):
+            self._index.setdefault(new_key, existing["candidate_id"])
+        self._index_candidate(existing)
+        key_type = key.split(":", 1)[0]
+        self.stats_counts["merged"] += 1
+        self.stats_counts["fields_merged"] += len(changed)
+        self.stats_counts["merged_by_key"][key_type] = self.stats_counts["merged_by_key"].get(key_type, 0) + 1
+        return existing, True
+
+    def stats(self):
+        sightings = self.stats_counts["sightings"]
+        return {
+            "unique_candidates": len(self.candidates),
+            "sightings": sightings,
+            "added": self.stats_counts["added"],
+            "merged": self.stats_counts["merged"],
+            "fields_merged": self.stats_counts["fields_merged"],
+            "merged_by_key": dict(self.stats_counts["merged_by_key"]),
+            "duplicate_rate": self.stats_counts["merged"] / sightings if sightings else 0.0
+        }
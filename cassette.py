@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Process-wide cassette for app.py runs: CASSETTE_MODE=record|replay, one session at a time
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassettes/session.jsonl")
+CASSETTE_TIMING = os.getenv("CASSETTE_TIMING", "zero")
+
+
+class CassetteMissError(Exception):
+    """Replay asked for an LLM call or tool result the cassette does not contain"""
+
+
+def request_key(kind, request):
+    payload = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{kind}\x00{payload}".encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Recording of the external calls of an agent session: every Nova Lite response
+    (with stream deltas and their timing) and every replayable tool result.
+
+    In "record" mode calls run live and are appended to a JSONL file as they finish;
+    the file is only created (and an existing one replaced) on the first recorded call.
+    In "replay" mode they are answered from the file: entries are matched by a hash
+    of the request, falling back to the next unused entry of the same kind when the
+    request changed (e.g. a prompt containing a timestamp). With timing="real" replay
+    sleeps for the recorded latency; with timing="zero" it returns immediately, so
+    a run measures only the agent's own overhead.
+    """
+
+    def __init__(self, path, mode="replay", timing="zero", header=None):
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.header = header or {}
+        self._lock = threading.Lock()
+        self._entries = []
+        self._unused = {}  # (kind, key) -> indexes of unused entries, in recorded order
+        self._unused_by_kind = {}  # kind -> indexes of unused entries
+        self._stats = {"recorded": 0, "replayed": 0, "exact_matches": 0, "fallback_matches": 0,
+                       "recorded_seconds": 0.0, "replayed_seconds": 0.0}
+
+        self._file = None
+        if mode == "replay":
+            self._load()
+        elif mode != "record":
+            raise ValueError(f"Unknown cassette mode: {mode}")
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["type"] == "header":
+                    self.header = entry
+                    continue
+                index = len(self._entries)
+                self._entries.append(entry)
+                kind = self._kind(entry)
+                self._unused.setdefault((kind, entry["key"]), []).append(index)
+                self._unused_by_kind.setdefault(kind, []).append(index)
+                self._stats["recorded_seconds"] += entry.get("duration", 0.0)
+
+    @staticmethod
+    def _kind(entry):
+        return "llm" if entry["type"] == "llm" else f"tool:{entry['name']}"
+
+    def _open_for_record(self):
+        """Create the cassette file on the first write; called with the lock held"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "w")
+        header = dict(self.header, type="header", recorded_at=time.time())
+        self._file.write(json.dumps(header, default=str) + "\n")
+
+    def _write(self, entry):
+        with self._lock:
+            if self._file is None:
+                self._open_for_record()
+            self._file.write(json.dumps(entry, default=str) + "\n")
+            self._file.flush()
+            self._stats["recorded"] += 1
+
+    def _take(self, kind, key):
+        """Pop the entry recorded for this request (or the next unused one of its kind)"""
+        with self._lock:
+            indexes = self._unused.get((kind, key))
+            if indexes:
+                index = indexes.pop(0)
+                self._stats["exact_matches"] += 1
+            else:
+                remaining = self._unused_by_kind.get(kind)
+                if not remaining:
+                    raise CassetteMissError(f"No recorded {kind} call left in {self.path}")
+                index = remaining[0]
+                self._stats["fallback_matches"] += 1
+            entry = self._entries[index]
+            self._unused_by_kind[kind].remove(index)
+            unused = self._unused[(kind, entry["key"])]
+            if index in unused:
+                unused.remove(index)
+            self._stats["replayed"] += 1
+            self._stats["replayed_seconds"] += entry.get("duration", 0.0)
+            return entry
+
+    def llm(self, request, live, on_delta=None):
+        """
+        Record or replay one LLM call.
+
+        Args:
+            request: JSON-serializable description of the call (prompt, system)
+            live: Callable taking an on_delta callback and making the real call
+            on_delta: Optional stream callback; replay feeds it the recorded deltas
+        """
+        key = request_key("llm", request)
+        if self.mode == "replay":
+            entry = self._take("llm", key)
+            elapsed = 0.0
+            if on_delta:
+                for offset, delta in entry.get("deltas", []):
+                    if self.timing == "real" and offset > elapsed:
+                        time.sleep(offset - elapsed)
+                        elapsed = offset
+                    on_delta(delta)
+            if self.timing == "real":
+                time.sleep(max(entry.get("duration", 0.0) - elapsed, 0.0))
+            if "error" in entry:
+                raise RuntimeError(entry["error"])
+            return entry["response"]
+
+        start = time.monotonic()
+        deltas = []
+
+        def record_delta(delta):
+            deltas.append([round(time.monotonic() - start, 4), delta])
+            if on_delta:
+                on_delta(delta)
+
+        entry = {"type": "llm", "key": key, "request": request}
+        try:
+            response = live(record_delta)
+            entry["response"] = response
+            return response
+        except Exception as e:
+            entry["error"] = str(e)
+            raise
+        finally:
+            entry["duration"] = round(time.monotonic() - start, 4)
+            entry["deltas"] = deltas
+            self._write(entry)
+
+    async def tool(self, name, inputs, live):
+        """Record or replay one tool call; live is a coroutine function making the real call"""
+        key = request_key(f"tool:{name}", inputs)
+        if self.mode == "replay":
+            entry = self._take(f"tool:{name}", key)
+            if self.timing == "real":
+                await asyncio.sleep(entry.get("duration", 0.0))
+            if "error" in entry:
+                raise RuntimeError(entry["error"])
+            return entry["response"]
+
+        start = time.monotonic()
+        entry = {"type": "tool", "name": name, "key": key, "request": inputs}
+        try:
+            response = await live()
+            # Round-trip through JSON so replay returns exactly what was recorded
+            entry["response"] = json.loads(json.dumps(response, default=str))
+            return response
+        except Exception as e:
+            entry["error"] = str(e)
+            raise
+        finally:
+            entry["duration"] = round(time.monotonic() - start, 4)
+            self._write(entry)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, mode=self.mode, timing=self.timing, path=self.path)
+            if self.mode == "replay":
+                stats["unused"] = sum(len(indexes) for indexes in self._unused_by_kind.values())
+            return stats
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+_active_cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_TIMING) if CASSETTE_MODE else None
+
+
+def active_cassette():
+    """The cassette external calls currently go through, or None"""
+    return _active_cassette
+
+
+@contextmanager
+def use_cassette(path, mode="replay", timing="zero", header=None):
+    """Route LLM calls and replayable tools through a cassette for the duration of the block"""
+    global _active_cassette
+    previous = _active_cassette
+    cassette = Cassette(path, mode, timing, header)
+    _active_cassette = cassette
+    try:
+        yield cassette
+    finally:
+        _active_cassette = previous
+        cassette.close()
+
+
+async def run_session(user_input, driver="run_agent"):
+    """
+    Run one agent turn under the active cassette with a fresh session.
+
+    driver "run_agent" calls AutonomousOutreachAgent.run_agent; "app" consumes the
+    agent's event generator through a StreamingAgent, as the SSE stream does.
+    Returns the number of streamed messages (0 for run_agent).
+    """
+    from agent import AutonomousOutreachAgent, set_input_handler
+
+    session_id = f"cassette-{uuid.uuid4().hex[:8]}"
+    if driver == "app":
+        from app import StreamingAgent
+        streaming_agent = StreamingAgent(session_id)
+        messages = 0
+        async for _ in streaming_agent.run_messages(user_input):
+            messages += 1
+        return messages
+
+    # The turn ends when the agent asks the user something; never block on stdin
+    set_input_handler(lambda message, session_id: None)
+    await AutonomousOutreachAgent(session_id).run_agent(user_input)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay the external calls of an agent run")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("path", help="Cassette file (JSONL)")
+    parser.add_argument("user_input", nargs="?", help="User message to start the run (record mode)")
+    parser.add_argument("--timing", choices=["real", "zero"], default="zero", help="Replay latency")
+    parser.add_argument("--driver", choices=["run_agent", "app"], default="run_agent")
+    args = parser.parse_args()
+
+    if args.mode == "record" and not args.user_input:
+        parser.error("record mode needs the user input")
+
+    header = {"user_input": args.user_input, "driver": args.driver}
+    with use_cassette(args.path, args.mode, args.timing, header) as cassette:
+        user_input = args.user_input or cassette.header.get("user_input", "")
+        start = time.monotonic()
+        messages = asyncio.run(run_session(user_input, args.driver))
+        wall = time.monotonic() - start
+        stats = cassette.stats()
+
+    print(f"⏱️ {args.mode} via {args.driver}: {wall:.3f}s wall clock, {messages} streamed messages")
+    if args.mode == "replay":
+        external = stats["replayed_seconds"] if args.timing == "real" else 0.0
+        print(f"📼 Replayed {stats['replayed']} calls ({stats['exact_matches']} exact, "
+              f"{stats['fallback_matches']} by order, {stats['unused']} unused); "
+              f"recorded external time {stats['recorded_seconds']:.3f}s")
+        print(f"🧮 Agent overhead: {max(wall - external, 0.0):.3f}s")
+    else:
+        print(f"📼 Recorded {stats['recorded']} calls to {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
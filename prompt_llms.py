@@ -1,33 +1,329 @@
 import os
 import boto3
 import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError, HTTPClientError, ConnectionError as BotocoreConnectionError
 from dotenv import load_dotenv
+from llm_cache import llm_cache
+from singleflight import llm_flight, make_flight_key
+from adaptive_limiter import AdaptiveLimiter
+from cassette import active_cassette
 
 load_dotenv()
 
-# Initialize Bedrock client
-bedrock = boto3.client("bedrock-runtime", region_name=os.getenv("AWS_REGION", "us-east-1"))
+# Max pooled HTTP connections to Bedrock, shared by every caller in the process
+BEDROCK_MAX_CONNECTIONS = int(os.getenv("BEDROCK_MAX_CONNECTIONS", "20"))
+
+# Initialize Bedrock client (boto3 clients are thread-safe, so one pooled client is shared).
+# botocore's own retries are disabled so throttling reaches the adaptive limiter below,
+# which retries throttles and transient errors (5xx, dropped connections, read timeouts) itself.
+bedrock = boto3.client(
+    "bedrock-runtime",
+    region_name=os.getenv("AWS_REGION", "us-east-1"),
+    config=Config(max_pool_connections=BEDROCK_MAX_CONNECTIONS, retries={"total_max_attempts": 1})
+)
+
+BEDROCK_THROTTLE_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException"
+}
+
+BEDROCK_TRANSIENT_CODES = {
+    "InternalServerException",
+    "ModelStreamErrorException",
+    "ModelTimeoutException"
+}
+
+def _is_bedrock_throttle(error):
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in BEDROCK_THROTTLE_CODES
+
+def _is_bedrock_transient(error):
+    """Errors botocore's standard retry mode would retry, other than throttling"""
+    if isinstance(error, (BotocoreConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return status >= 500 or error.response.get("Error", {}).get("Code") in BEDROCK_TRANSIENT_CODES
+    return False
+
+# AIMD concurrency window shared by every Bedrock call in the process
+bedrock_limiter = AdaptiveLimiter(
+    "bedrock",
+    initial_limit=int(os.getenv("BEDROCK_LIMIT_INITIAL", "4")),
+    min_limit=1,
+    max_limit=BEDROCK_MAX_CONNECTIONS,
+    max_retries=int(os.getenv("BEDROCK_MAX_RETRIES", "5")),
+    base_delay=float(os.getenv("BEDROCK_RETRY_BASE_DELAY", "0.5")),
+    is_throttle=_is_bedrock_throttle,
+    is_transient=_is_bedrock_transient
+)
+
+# Worker threads for the async wrapper, sized to the connection pool so no call waits on a socket
+_bedrock_executor = ThreadPoolExecutor(max_workers=BEDROCK_MAX_CONNECTIONS, thread_name_prefix="bedrock")
 
 # Nova Lite model ID for Bedrock
 MODEL_ID = "amazon.nova-lite-v1:0"
+MAX_OUTPUT_TOKENS = 10000
+
+# Bedrock prompt caching: the system block is marked as a cacheable prefix on models that support it
+PROMPT_CACHING_ENABLED = os.getenv("BEDROCK_PROMPT_CACHING", "true").lower() == "true"
+PROMPT_CACHING_MODELS = {
+    "amazon.nova-micro-v1:0",
+    "amazon.nova-lite-v1:0",
+    "amazon.nova-pro-v1:0",
+    "amazon.nova-premier-v1:0"
+}
+
+# Process-wide token usage, including how much of the input was served from the prompt cache
+_usage_lock = threading.Lock()
+_usage_totals = {
+    "calls": 0,
+    "input_tokens": 0,
+    "output_tokens": 0,
+    "cache_read_input_tokens": 0,
+    "cache_write_input_tokens": 0
+}
+
+def _to_content_blocks(content):
+    """Normalize message content (a string or a list of blocks) to Bedrock content blocks"""
+    if isinstance(content, str):
+        return [{"text": content}]
+    return list(content)
+
+def build_request_body(prompt, system=None):
+    """
+    Build a Nova messages-v1 request body.
+
+    prompt is either a plain string (sent as one user turn) or a list of
+    {"role": "user"|"assistant", "content": str | [blocks]} messages.
+    system is an optional instruction string or list of system blocks.
+    """
+    if isinstance(prompt, str):
+        prompt = [{"role": "user", "content": prompt}]
 
-# Function to call AWS Bedrock Nova Lite
-def prompt_nova_lite(text):
     body = {
+        "schemaVersion": "messages-v1",
         "messages": [
-            {"role": "user", "content": text}
+            {"role": message["role"], "content": _to_content_blocks(message["content"])}
+            for message in prompt
         ],
-        "max_tokens": 10000
+        "inferenceConfig": {"maxTokens": MAX_OUTPUT_TOKENS}
     }
-    response = bedrock.invoke_model(
-        modelId=MODEL_ID,
-        body=json.dumps(body),
-        accept="application/json",
-        contentType="application/json"
-    )
-    result = json.loads(response["body"].read())
+    if system:
+        body["system"] = _to_content_blocks(system)
+        if PROMPT_CACHING_ENABLED and MODEL_ID in PROMPT_CACHING_MODELS:
+            body["system"].append({"cachePoint": {"type": "default"}})
+    return body
+
+def _parse_usage(usage):
+    """Normalize Bedrock usage counters (invoke body, stream metadata or invocation metrics)"""
+    return {
+        "input_tokens": usage.get("inputTokens", usage.get("inputTokenCount", 0)) or 0,
+        "output_tokens": usage.get("outputTokens", usage.get("outputTokenCount", 0)) or 0,
+        "cache_read_input_tokens": usage.get("cacheReadInputTokens", usage.get("cacheReadInputTokenCount", 0)) or 0,
+        "cache_write_input_tokens": usage.get("cacheWriteInputTokens", usage.get("cacheWriteInputTokenCount", 0)) or 0
+    }
+
+def _record_usage(usage, on_usage=None):
+    with _usage_lock:
+        _usage_totals["calls"] += 1
+        for key, value in usage.items():
+            _usage_totals[key] += value
+    if on_usage:
+        on_usage(usage)
+
+def usage_stats():
+    """Process-wide token usage totals with the prompt-cache read ratio"""
+    with _usage_lock:
+        totals = dict(_usage_totals)
+    total_input = totals["input_tokens"] + totals["cache_read_input_tokens"] + totals["cache_write_input_tokens"]
+    totals["cached_input_ratio"] = totals["cache_read_input_tokens"] / total_input if total_input else 0.0
+    return totals
+
+def _cache_key(prompt, system):
+    return prompt if system is None else {"system": system, "messages": prompt}
+
+def is_json_reply(reply):
+    """Whether a reply contains a parseable JSON object; pass as validate= for prompts that ask for JSON"""
+    if not isinstance(reply, str):
+        return False
+    start, end = reply.find("{"), reply.rfind("}")
+    if start < 0 or end < start:
+        return False
+    try:
+        json.loads(reply[start:end + 1])
+        return True
+    except ValueError:
+        return False
+
+def _cacheable(reply, validate):
+    return validate is None or validate(reply)
+
+def _extract_reply(result):
+    """Pull the reply text out of an invoke_model response body"""
+    content = result.get("output", {}).get("message", {}).get("content") or result.get("content")
+    if content:
+        return content[0].get("text")
+    return None
+
+def _invoke_nova_lite(prompt, system=None, on_usage=None, validate=None):
+    """Call Bedrock Nova Lite and cache the reply if it passes validate"""
+    body = build_request_body(prompt, system)
+
+    def invoke():
+        response = bedrock.invoke_model(
+            modelId=MODEL_ID,
+            body=json.dumps(body),
+            accept="application/json",
+            contentType="application/json"
+        )
+        return json.loads(response["body"].read())
+
+    result = bedrock_limiter.call(invoke)
+    if "usage" in result:
+        _record_usage(_parse_usage(result["usage"]), on_usage)
     # Extract the model's reply
-    return result["content"][0]["text"] if "content" in result and result["content"] else result
+    reply = _extract_reply(result)
+    if reply is None:
+        return result
+    if llm_cache and _cacheable(reply, validate):
+        llm_cache.set(MODEL_ID, _cache_key(prompt, system), reply)
+    return reply
+
+# Function to call AWS Bedrock Nova Lite
+def prompt_nova_lite(prompt, use_cache=True, system=None, on_usage=None, validate=None):
+    """
+    Prompt Nova Lite and return the reply text.
+
+    prompt is a string or a list of user/assistant messages, with optional
+    system instructions (see build_request_body). Identical prompts are
+    answered from the on-disk response cache, and identical prompts already
+    in flight share one Bedrock request. Pass use_cache=False to force a
+    fresh call (e.g. when retrying a bad reply). With validate (e.g.
+    is_json_reply), only replies passing it are cached or served from the
+    cache, so a malformed reply is never replayed to a retry. on_usage receives
+    the token usage of the Bedrock call, if one was made. Under an active
+    cassette the call is replayed, or recorded from a live Bedrock call that
+    bypasses the response cache (see cassette.py).
+    """
+    cassette = active_cassette()
+    if cassette is not None:
+        return cassette.llm(
+            {"prompt": prompt, "system": system},
+            lambda on_delta: _prompt_nova_lite(prompt, False, system, on_usage, validate)
+        )
+    return _prompt_nova_lite(prompt, use_cache, system, on_usage, validate)
+
+def _prompt_nova_lite(prompt, use_cache, system, on_usage, validate=None):
+    if not use_cache:
+        return _invoke_nova_lite(prompt, system, on_usage, validate)
+
+    if llm_cache:
+        cached = llm_cache.get(MODEL_ID, _cache_key(prompt, system))
+        if cached is not None and _cacheable(cached, validate):
+            return cached
+
+    return llm_flight.do(make_flight_key(MODEL_ID, _cache_key(prompt, system)), _invoke_nova_lite, prompt, system, on_usage, validate)
+
+def _extract_stream_text(event):
+    """Pull the text delta out of one decoded response-stream chunk"""
+    if "contentBlockDelta" in event:
+        return event["contentBlockDelta"].get("delta", {}).get("text", "")
+    if event.get("type") == "content_block_delta":
+        return event.get("delta", {}).get("text", "")
+    return ""
+
+def prompt_nova_lite_stream(prompt, on_delta=None, use_cache=True, system=None, on_usage=None, validate=None):
+    """
+    Prompt Nova Lite through Bedrock's response-streaming API.
+
+    on_delta is called with each piece of reply text as it arrives; the full
+    reply is returned once the stream ends. Cached replies are passed to
+    on_delta in one piece. use_cache and validate work as in prompt_nova_lite.
+    """
+    cassette = active_cassette()
+    if cassette is not None:
+        return cassette.llm(
+            {"prompt": prompt, "system": system},
+            lambda recording_on_delta: _prompt_nova_lite_stream(prompt, recording_on_delta, False, system, on_usage, validate),
+            on_delta
+        )
+    return _prompt_nova_lite_stream(prompt, on_delta, use_cache, system, on_usage, validate)
+
+def _prompt_nova_lite_stream(prompt, on_delta, use_cache, system, on_usage, validate=None):
+    if not use_cache:
+        return _invoke_nova_lite_stream(on_delta, prompt, system, on_usage, validate)
+
+    if llm_cache:
+        cached = llm_cache.get(MODEL_ID, _cache_key(prompt, system))
+        if cached is not None and _cacheable(cached, validate):
+            if on_delta and isinstance(cached, str):
+                on_delta(cached)
+            return cached
+
+    # Identical prompts in flight (e.g. campaigns started from one template) share one stream
+    return llm_flight.do_stream(
+        make_flight_key(MODEL_ID, _cache_key(prompt, system)), _invoke_nova_lite_stream, on_delta,
+        prompt, system, on_usage, validate
+    )
+
+def _invoke_nova_lite_stream(on_delta, prompt, system=None, on_usage=None, validate=None):
+    """Call Bedrock Nova Lite with response streaming and cache the reply if it passes validate"""
+    body = build_request_body(prompt, system)
+    usage = None
+
+    def stream():
+        nonlocal usage
+        parts = []
+        try:
+            response = bedrock.invoke_model_with_response_stream(
+                modelId=MODEL_ID,
+                body=json.dumps(body),
+                accept="application/json",
+                contentType="application/json"
+            )
+            for event in response["body"]:
+                chunk = event.get("chunk")
+                if not chunk:
+                    continue
+                payload = json.loads(chunk["bytes"])
+                if "usage" in payload.get("metadata", {}):
+                    usage = _parse_usage(payload["metadata"]["usage"])
+                elif "amazon-bedrock-invocationMetrics" in payload:
+                    usage = _parse_usage(payload["amazon-bedrock-invocationMetrics"])
+                delta = _extract_stream_text(payload)
+                if delta:
+                    parts.append(delta)
+                    if on_delta:
+                        on_delta(delta)
+        except (ClientError, BotocoreConnectionError, HTTPClientError) as e:
+            # Deltas already reached the caller, so a retry would duplicate them
+            if parts:
+                raise RuntimeError(f"Bedrock stream interrupted: {e}") from e
+            raise
+        return "".join(parts)
+
+    reply = bedrock_limiter.call(stream)
+    if usage:
+        _record_usage(usage, on_usage)
+    if reply and llm_cache and _cacheable(reply, validate):
+        llm_cache.set(MODEL_ID, _cache_key(prompt, system), reply)
+    return reply
+
+async def prompt_nova_lite_stream_async(prompt, on_delta=None, use_cache=True, system=None, on_usage=None, validate=None):
+    """Awaitable version of prompt_nova_lite_stream; callbacks run on a Bedrock worker thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bedrock_executor, prompt_nova_lite_stream, prompt, on_delta, use_cache, system, on_usage, validate)
+
+async def prompt_nova_lite_async(prompt, use_cache=True, system=None, on_usage=None, validate=None):
+    """Awaitable version of prompt_nova_lite that does not block the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bedrock_executor, prompt_nova_lite, prompt, use_cache, system, on_usage, validate)
 
 if __name__ == "__main__":
     text = "What is the capital of France?"
@@ -0,0 +1,239 @@
+import os
+import json
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Journal operations between compacted snapshots; bounds replay time in load()
+STATE_SNAPSHOT_EVERY = int(os.getenv("STATE_SNAPSHOT_EVERY", "200"))
+# fsync every journal append (survives power loss, not just process crashes)
+STATE_JOURNAL_FSYNC = os.getenv("STATE_JOURNAL_FSYNC", "false").lower() == "true"
+
+# State keys that only ever grow at the end; new items are journaled as appends
+APPEND_ONLY_KEYS = ("conversation_history", "candidates", "errors", "prefilter_runs", "followup_emails")
+
+
+class SessionJournal:
+    """
+    Append-only persistence for one agent's state.
+
+    The state lives in a compacted snapshot plus a journal of mutations since that
+    snapshot, kept by a storage backend (FileJournalStorage, or the campaign store).
+    save() appends only the change since what was last persisted: new items of
+    append-only lists, in-place item updates it is told about, and the values of
+    keys the caller marks dirty (or that are new). Unchanged keys are never
+    re-serialized, so the cost of a save does not grow with the session. Every
+    STATE_SNAPSHOT_EVERY ops the journal is folded into a new snapshot.
+    Ops carry sequence numbers so ops already in a snapshot are never replayed.
+    """
+
+    def __init__(self, storage, snapshot_every=STATE_SNAPSHOT_EVERY):
+        self.storage = storage
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self.ops_since_snapshot = 0
+        self._lock = threading.Lock()
+        self._state_id = None
+        self._keys = set()
+        self._list_ids = {}
+        self._lengths = {}
+        self._stats = {"appends": 0, "ops": 0, "bytes": 0, "snapshots": 0, "replayed_ops": 0}
+
+    def _track(self, state):
+        """Remember the persisted shape of the state as the baseline for the next diff"""
+        self._state_id = id(state)
+        self._keys = set(state)
+        self._list_ids, self._lengths = {}, {}
+        for key, value in state.items():
+            if key in APPEND_ONLY_KEYS and isinstance(value, list):
+                self._list_ids[key] = id(value)
+                self._lengths[key] = len(value)
+
+    def _diff(self, state, modified, dirty):
+        if id(state) != self._state_id:
+            # A different state object than the one persisted: rewrite every key once
+            dirty = set(state)
+            self._state_id = id(state)
+        ops = []
+        # Keys added while a worker thread saves are picked up by the next save
+        entries = list(state.items())
+        for key, value in entries:
+            items = (modified or {}).get(key, {})
+            if key in APPEND_ONLY_KEYS and isinstance(value, list):
+                if key in self._lengths and id(value) == self._list_ids[key] and len(value) >= self._lengths[key] \
+                        and key not in dirty:
+                    saved = self._lengths[key]
+                    for index, item in sorted(items.items()):
+                        if index < saved:
+                            ops.append({"op": "item", "key": key, "index": index, "value": item})
+                    # Slice once: an append racing a save in a worker thread lands in the next save
+                    added = value[saved:]
+                    if added:
+                        ops.append({"op": "extend", "key": key, "items": added})
+                    self._lengths[key] = saved + len(added)
+                else:
+                    self._list_ids[key] = id(value)
+                    value = list(value)
+                    ops.append({"op": "set", "key": key, "value": value})
+                    self._lengths[key] = len(value)
+            elif key not in self._keys or key in dirty:
+                ops.append({"op": "set", "key": key, "value": value})
+                self._lengths.pop(key, None)
+            else:
+                # Entries of a dict (e.g. searches) or list updated in place
+                for index, item in items.items():
+                    ops.append({"op": "item", "key": key, "index": index, "value": item})
+        keys = {key for key, _ in entries}
+        for key in self._keys - keys:
+            ops.append({"op": "delete", "key": key})
+            self._lengths.pop(key, None)
+        self._keys = keys
+        return ops
+
+    @staticmethod
+    def _apply(state, op):
+        key = op["key"]
+        if op["op"] == "set":
+            state[key] = op["value"]
+        elif op["op"] == "extend":
+            state.setdefault(key, []).extend(op["items"])
+        elif op["op"] == "item":
+            state[key][op["index"]] = op["value"]
+        elif op["op"] == "delete":
+            state.pop(key, None)
+
+    def save(self, state, modified=None, dirty=()):
+        """
+        Persist the changes made to `state` since the last save, load or snapshot.
+
+        Args:
+            state: The agent state dict
+            modified: Optional {key: {index or field: item}} of list items or dict
+                      entries changed in place
+            dirty: Keys whose value was replaced or changed otherwise; other keys are
+                   assumed unchanged apart from appends and `modified` items
+        """
+        with self._lock:
+            ops = self._diff(state, modified, set(dirty))
+            if not ops:
+                return
+            for op in ops:
+                self.seq += 1
+                op["seq"] = self.seq
+            written = self.storage.append(ops)
+            self.ops_since_snapshot += len(ops)
+            self._stats["appends"] += 1
+            self._stats["ops"] += len(ops)
+            self._stats["bytes"] += written
+            if self.ops_since_snapshot >= self.snapshot_every:
+                self._snapshot(state)
+
+    def snapshot(self, state):
+        """Write a compacted snapshot of the full state and drop the folded journal ops"""
+        with self._lock:
+            self._snapshot(state)
+
+    def _snapshot(self, state):
+        self.storage.write_snapshot(state, self.seq)
+        self.ops_since_snapshot = 0
+        self._stats["snapshots"] += 1
+        self._track(state)
+
+    def load(self):
+        """
+        Rebuild the state from the snapshot and the journal ops recorded after it.
+
+        Returns None if neither exists.
+        """
+        with self._lock:
+            state, base_seq = self.storage.read_snapshot()
+            self.seq = base_seq
+            self.ops_since_snapshot = 0
+            for op in self.storage.read_ops(base_seq):
+                if state is None:
+                    state = {}
+                self._apply(state, op)
+                self.seq = op["seq"]
+                self.ops_since_snapshot += 1
+                self._stats["replayed_ops"] += 1
+            if state is not None:
+                self._track(state)
+            return state
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, seq=self.seq, ops_since_snapshot=self.ops_since_snapshot)
+
+
+class FileJournalStorage:
+    """
+    Snapshot (`<name>.json`) plus journal (`<name>.journal.jsonl`, one JSON op per line) on disk.
+
+    The snapshot records the last op it contains, so a crash between writing it and
+    truncating the journal never applies an op twice. A torn final line left by a
+    crash mid-append is ignored and truncated on load.
+    """
+
+    def __init__(self, snapshot_path, fsync=STATE_JOURNAL_FSYNC):
+        self.snapshot_path = snapshot_path
+        base = snapshot_path[:-5] if snapshot_path.endswith(".json") else snapshot_path
+        self.journal_path = f"{base}.journal.jsonl"
+        self.fsync = fsync
+        self.torn_lines = 0
+
+    def exists(self):
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.journal_path)
+
+    def append(self, ops):
+        data = "".join(json.dumps(op) + "\n" for op in ops)
+        with open(self.journal_path, "a") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        return len(data)
+
+    def write_snapshot(self, state, seq):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"journal_seq": seq, "state": state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Ops up to journal_seq are in the snapshot; a crash before truncation is harmless
+        open(self.journal_path, "w").close()
+
+    def read_snapshot(self):
+        """(state, journal_seq); accepts legacy snapshots holding the bare state dict"""
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None, 0
+        if isinstance(snapshot, dict) and "journal_seq" in snapshot and "state" in snapshot:
+            return snapshot["state"], snapshot["journal_seq"]
+        return snapshot, 0
+
+    def read_ops(self, after_seq):
+        ops = []
+        valid_bytes = 0
+        try:
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("unterminated line")
+                        op = json.loads(line)
+                    except ValueError:
+                        self.torn_lines += 1
+                        break
+                    valid_bytes += len(line)
+                    if op["seq"] > after_seq:
+                        ops.append(op)
+            if valid_bytes < os.path.getsize(self.journal_path):
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(valid_bytes)
+        except FileNotFoundError:
+            pass
+        return ops
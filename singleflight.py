@@ -0,0 +1,153 @@
+import copy
+import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+
+
+def make_flight_key(*parts):
+    """Stable key for a call made of JSON-serializable parts (name, inputs, ...)"""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DeltaStream:
+    """Pieces of an in-flight streamed reply, replayed to every caller coalesced onto it"""
+
+    def __init__(self):
+        self.parts = []
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def publish(self, delta):
+        # Delivered under the lock so a listener joining mid-stream never sees pieces out of order
+        with self._lock:
+            self.parts.append(delta)
+            for listener in self.listeners:
+                listener(delta)
+
+    def listen(self, on_delta):
+        """Send the pieces streamed so far to on_delta, then every new one"""
+        with self._lock:
+            for delta in self.parts:
+                on_delta(delta)
+            self.listeners.append(on_delta)
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls.
+
+    The first caller for a key runs the call; callers arriving with the same key
+    while it is running wait for that result instead of issuing their own request.
+    Works across threads and event loops, since each Flask session runs its own loop.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._streams = {}  # key -> DeltaStream of a streamed call in flight
+
+    def _join(self, key):
+        """Return (future, is_leader) for the key"""
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._streams.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run a blocking call once per key across concurrent callers"""
+        future, is_leader = self._join(key)
+        if not is_leader:
+            return copy.deepcopy(future.result())
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def do_stream(self, key, fn, on_delta=None, *args, **kwargs):
+        """
+        Like do() for a streamed call: fn(publish, *args, **kwargs) reports each piece of
+        its reply through publish. Followers get the pieces the leader streamed so far
+        and then the rest as they arrive; a follower of a non-streamed call gets the
+        whole result in one piece.
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+                stream = self._streams[key] = DeltaStream()
+            else:
+                self.coalesced += 1
+                stream = self._streams.get(key)
+
+        if not is_leader:
+            if on_delta and stream is not None:
+                stream.listen(on_delta)
+            result = copy.deepcopy(future.result())
+            if on_delta and stream is None and isinstance(result, str):
+                on_delta(result)
+            return result
+
+        if on_delta:
+            stream.listen(on_delta)
+        try:
+            result = fn(stream.publish, *args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    async def do_async(self, key, coro_fn, *args, **kwargs):
+        """Await a coroutine function once per key across concurrent callers"""
+        future, is_leader = self._join(key)
+        if not is_leader:
+            return copy.deepcopy(await asyncio.wrap_future(future))
+        try:
+            result = await coro_fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def stats(self):
+        """Call and coalescing counters"""
+        with self._lock:
+            inflight = len(self._inflight)
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "executed": self.calls - self.coalesced,
+            "inflight": inflight
+        }
+
+
+# Shared flights for LLM prompts and idempotent tool calls
+llm_flight = SingleFlight("llm")
+tool_flight = SingleFlight("tools")
@@ -0,0 +1,150 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Messages each session keeps for its subscribers; bounds memory however slow a subscriber is
+SSE_BUFFER_SIZE = int(os.getenv("SSE_BUFFER_SIZE", "1000"))
+# What happens to a subscriber that falls a full buffer behind: "drop_oldest" or "disconnect"
+SSE_SLOW_CONSUMER_POLICY = os.getenv("SSE_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect")
+
+
+class SlowConsumerError(Exception):
+    """The subscriber fell a full buffer behind and was disconnected"""
+
+
+class Subscriber:
+    """One reader of a BroadcastHub, with its own cursor into the shared buffer"""
+
+    def __init__(self, hub, cursor):
+        self.hub = hub
+        self.cursor = cursor  # Sequence number of the next message to read
+        self.dropped = 0
+        self.skipped = 0  # Dropped messages not yet reported by read()
+        self.closed = False
+
+    def read(self, timeout=None, max_items=100):
+        """
+        Wait up to timeout seconds for messages and return up to max_items of them.
+
+        Returns an empty list on timeout and None once the hub is closed and every
+        message was read. Messages carry consecutive sequence numbers ending at
+        cursor - 1 after the read. Under the drop_oldest policy, check `skipped`
+        afterwards for messages lost since the previous read.
+
+        Raises:
+            SlowConsumerError: Under the disconnect policy, when the subscriber fell too far behind
+        """
+        return self.hub._read(self, timeout, max_items)
+
+    def close(self):
+        self.hub._unsubscribe(self)
+
+
+class BroadcastHub:
+    """
+    Fan-out of one session's stream messages to any number of subscribers.
+
+    Messages go into a ring buffer of `capacity` slots shared by all subscribers;
+    each subscriber reads at its own cursor, so every open tab sees every message
+    and publishing never waits for a reader. A subscriber that falls more than
+    `capacity` messages behind either skips ahead to the oldest message still
+    buffered (drop_oldest) or is disconnected (disconnect).
+    """
+
+    def __init__(self, capacity=SSE_BUFFER_SIZE, policy=SSE_SLOW_CONSUMER_POLICY):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self._buffer = [None] * capacity
+        self._next_seq = 0  # Sequence number the next published message gets
+        self._changed = threading.Condition()
+        self._subscribers = set()
+        self.closed = False
+        self.published = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+    def publish(self, message):
+        with self._changed:
+            self._buffer[self._next_seq % self.capacity] = message
+            self._next_seq += 1
+            self.published += 1
+            self._changed.notify_all()
+
+    def subscribe(self, last_seq=None):
+        """
+        New subscriber that receives messages published from now on.
+
+        A reconnecting reader passes the sequence number of the last message it got
+        (the SSE Last-Event-ID) to resume right after it. If some of the messages
+        since then already left the buffer, it resumes at the oldest buffered one and
+        reports the rest as skipped.
+        """
+        with self._changed:
+            cursor = self._next_seq
+            skipped = 0
+            if last_seq is not None and last_seq < self._next_seq:
+                oldest = max(self._next_seq - self.capacity, 0)
+                cursor = max(last_seq + 1, oldest)
+                skipped = cursor - (last_seq + 1)
+            subscriber = Subscriber(self, cursor)
+            subscriber.dropped = subscriber.skipped = skipped
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def close(self):
+        """Let subscribers read what is buffered, then end their streams"""
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    def _unsubscribe(self, subscriber):
+        with self._changed:
+            subscriber.closed = True
+            self._subscribers.discard(subscriber)
+
+    def _read(self, subscriber, timeout, max_items):
+        with self._changed:
+            if subscriber.cursor == self._next_seq and not self.closed:
+                self._changed.wait(timeout)
+
+            lag = self._next_seq - subscriber.cursor
+            if lag > self.capacity:
+                if self.policy == "disconnect":
+                    self.disconnected += 1
+                    subscriber.closed = True
+                    self._subscribers.discard(subscriber)
+                    raise SlowConsumerError(f"Subscriber fell {lag} messages behind")
+                skipped = lag - self.capacity
+                subscriber.cursor += skipped
+                subscriber.dropped += skipped
+                subscriber.skipped += skipped
+                self.dropped += skipped
+
+            if subscriber.cursor == self._next_seq:
+                return None if self.closed else []
+            end = min(self._next_seq, subscriber.cursor + max_items)
+            messages = [self._buffer[seq % self.capacity] for seq in range(subscriber.cursor, end)]
+            subscriber.cursor = end
+            return messages
+
+    def stats(self):
+        """Buffer occupancy: buffered messages, subscribers and how far behind the slowest one is"""
+        with self._changed:
+            max_lag = max((self._next_seq - s.cursor for s in self._subscribers), default=0)
+            return {
+                "capacity": self.capacity,
+                "policy": self.policy,
+                "buffered": min(self._next_seq, self.capacity),
+                "subscribers": len(self._subscribers),
+                "max_lag": max_lag,
+                "occupancy": min(max_lag, self.capacity) / self.capacity if self.capacity else 0.0,
+                "published": self.published,
+                "dropped": self.dropped,
+                "disconnected": self.disconnected
+            }
@@ -0,0 +1,99 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Worker threads per tool class; blocking tools of a class never use more than this many threads
+TOOL_POOL_SIZES = {
+    "search": int(os.getenv("TOOL_POOL_SEARCH", "8")),
+    "google": int(os.getenv("TOOL_POOL_GOOGLE", "4")),
+    "crypto": int(os.getenv("TOOL_POOL_CRYPTO", "2")),
+    "default": int(os.getenv("TOOL_POOL_DEFAULT", "4"))
+}
+
+# Tool class of each synchronous tool
+TOOL_CLASSES = {
+    "google_search": "search",
+    "search_for_channels": "search",
+    "send_email_with_token": "google",
+    "create_google_meet_meeting": "google",
+    "get_upcoming_meetings": "google",
+    "make_crypto_actions": "crypto"
+}
+
+
+class ToolPool:
+    """Bounded, named thread pool that runs blocking tools for async callers and tracks queueing"""
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"tool-{name}")
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def _run(self, submitted_at, fn, args, kwargs):
+        started_at = time.monotonic()
+        waited = started_at - submitted_at
+        with self._lock:
+            self.started += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.completed += 1
+                self.total_run += time.monotonic() - started_at
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn on the pool and await its result without blocking the event loop"""
+        with self._lock:
+            self.submitted += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run, time.monotonic(), fn, args, kwargs)
+
+    def stats(self):
+        """Queue depth, active workers and wait/run times"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.submitted - self.started,
+                "active": self.started - self.completed,
+                "completed": self.completed,
+                "avg_wait_seconds": self.total_wait / self.started if self.started else 0.0,
+                "max_wait_seconds": self.max_wait,
+                "avg_run_seconds": self.total_run / self.completed if self.completed else 0.0
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_tool_pool(tool_class):
+    """Shared pool for a tool class, created on first use"""
+    with _pools_lock:
+        if tool_class not in _pools:
+            size = TOOL_POOL_SIZES.get(tool_class, TOOL_POOL_SIZES["default"])
+            _pools[tool_class] = ToolPool(tool_class, size)
+        return _pools[tool_class]
+
+async def run_blocking_tool(function_name, fn, *args, **kwargs):
+    """Run a synchronous tool on its class's thread pool"""
+    pool = get_tool_pool(TOOL_CLASSES.get(function_name, "default"))
+    return await pool.run(fn, *args, **kwargs)
+
+def tool_pool_stats():
+    """Stats for every pool created so far"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {name: pool.stats() for name, pool in pools.items()}
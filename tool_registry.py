@@ -0,0 +1,231 @@
+import copy
+import time
+import asyncio
+import threading
+from cachetools import TTLCache
+
+from singleflight import tool_flight, make_flight_key
+from tool_executor import run_blocking_tool
+from cassette import active_cassette
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, float("inf")]
+
+
+class ToolSpec:
+    """
+    Declaration of one agent tool.
+
+    Args:
+        name: Function name exposed to the LLM
+        description: Description exposed to the LLM
+        parameters: JSON schema of the inputs
+        handler: Callable taking (agent, inputs); returns a coroutine for "async" tools
+        kind: "sync" (blocking, runs on a tool thread pool), "async" (awaited) or
+              "inline" (fast, runs directly on the event loop)
+        timeout: Seconds before the call is cancelled (None for no limit). A "sync" tool's
+                 thread cannot be stopped and finishes in the background
+        retries: Extra attempts after a failure or timeout (only for idempotent tools;
+                 "sync" tools are never retried after a timeout, as the first attempt still runs)
+        retry_delay: Base delay between attempts, doubled on each retry
+        cache_ttl: Seconds to reuse results for identical inputs (0 disables caching)
+        cost: Expected cost of one call in USD, for accounting
+        coalesce: Share one execution between identical concurrent calls
+        listed: Whether the tool is advertised to the LLM in FUNCTION_DEFINITIONS
+        replayable: Whether results are captured by cassettes and replayed instead of
+                    executing (tools that reach outside services or machine-specific data)
+        idempotent: False for tools with side effects (emails, meetings, transfers); they
+                    are never retried, and a timed-out "sync" call returns an "outcome
+                    unknown" result instead of an error so the LLM does not repeat it
+    """
+
+    def __init__(self, name, description, parameters, handler, kind="async", timeout=60,
+                 retries=0, retry_delay=1.0, cache_ttl=0, cost=0.0, coalesce=False, listed=True,
+                 replayable=False, idempotent=True):
+        if retries and not idempotent:
+            raise ValueError(f"Tool {name} has side effects and cannot be retried")
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.handler = handler
+        self.kind = kind
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.cache_ttl = cache_ttl
+        self.cost = cost
+        self.coalesce = coalesce
+        self.listed = listed
+        self.replayable = replayable
+        self.idempotent = idempotent
+
+    def definition(self):
+        """The LLM-facing function definition"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "parameters": self.parameters
+        }
+
+
+class ToolMetrics:
+    """Per-tool call counters and latency histogram"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.total_cost = 0.0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds):
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def stats(self):
+        executed = sum(self.buckets)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "total_cost": round(self.total_cost, 4),
+            "avg_seconds": self.total_seconds / executed if executed else 0.0,
+            "max_seconds": self.max_seconds,
+            "latency_histogram": {
+                ("+inf" if bound == float("inf") else f"<={bound}s"): count
+                for bound, count in zip(LATENCY_BUCKETS, self.buckets)
+            }
+        }
+
+
+class ToolRegistry:
+    """Registry of agent tools; generates the LLM function catalog and dispatches calls"""
+
+    def __init__(self):
+        self._tools = {}
+        self._metrics = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def register(self, spec):
+        self._tools[spec.name] = spec
+        self._metrics[spec.name] = ToolMetrics()
+        if spec.cache_ttl:
+            self._caches[spec.name] = TTLCache(maxsize=256, ttl=spec.cache_ttl)
+        return spec
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    def function_definitions(self):
+        """Definitions of the listed tools, in registration order"""
+        return [spec.definition() for spec in self._tools.values() if spec.listed]
+
+    async def _run_once(self, spec, agent, inputs):
+        if spec.kind == "sync":
+            call = run_blocking_tool(spec.name, spec.handler, agent, inputs)
+        elif spec.kind == "async":
+            call = spec.handler(agent, inputs)
+        else:
+            return spec.handler(agent, inputs)
+        # wait_for cancels the awaited call on timeout; a blocking tool's worker
+        # thread finishes in the background but the agent no longer waits on it
+        return await asyncio.wait_for(call, timeout=spec.timeout)
+
+    async def _run_with_retries(self, spec, agent, inputs):
+        metrics = self._metrics[spec.name]
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                result = await self._run_once(spec, agent, inputs)
+                with self._lock:
+                    metrics.observe(time.monotonic() - start)
+                    metrics.total_cost += spec.cost
+                return result
+            except asyncio.TimeoutError:
+                with self._lock:
+                    metrics.observe(time.monotonic() - start)
+                    metrics.timeouts += 1
+                if spec.kind == "sync" and not spec.idempotent:
+                    # The call is still running on its thread and may yet succeed
+                    return {
+                        "status": "unknown",
+                        "message": f"{spec.name} did not finish within {spec.timeout}s and is still running; "
+                                   f"its outcome is unknown. Do not call it again for the same request."
+                    }
+                if attempt >= spec.retries or spec.kind == "sync":
+                    raise TimeoutError(f"{spec.name} timed out after {spec.timeout}s")
+            except Exception:
+                with self._lock:
+                    metrics.observe(time.monotonic() - start)
+                if attempt >= spec.retries:
+                    raise
+            delay = spec.retry_delay * (2 ** attempt)
+            attempt += 1
+            with self._lock:
+                metrics.retries += 1
+            await asyncio.sleep(delay)
+
+    async def dispatch(self, name, agent, inputs):
+        """
+        Execute a registered tool, enforcing its timeout, retry policy, cache and coalescing.
+
+        Raises KeyError for unknown tools; tool errors propagate to the caller.
+        Replayable tools go through the active cassette, if any.
+        """
+        spec = self._tools[name]
+        cassette = active_cassette()
+        if cassette is not None and spec.replayable:
+            return await cassette.tool(name, inputs, lambda: self._dispatch(spec, agent, inputs))
+        return await self._dispatch(spec, agent, inputs)
+
+    async def _dispatch(self, spec, agent, inputs):
+        name = spec.name
+        metrics = self._metrics[name]
+        with self._lock:
+            metrics.calls += 1
+
+        key = None
+        cache = self._caches.get(name)
+        if cache is not None or spec.coalesce:
+            key = make_flight_key(name, inputs)
+        if cache is not None:
+            with self._lock:
+                if key in cache:
+                    metrics.cache_hits += 1
+                    return copy.deepcopy(cache[key])
+
+        try:
+            if spec.coalesce:
+                result = await tool_flight.do_async(key, self._run_with_retries, spec, agent, inputs)
+            else:
+                result = await self._run_with_retries(spec, agent, inputs)
+        except Exception:
+            with self._lock:
+                metrics.errors += 1
+            raise
+
+        if cache is not None:
+            with self._lock:
+                cache[key] = copy.deepcopy(result)
+        return result
+
+    def stats(self):
+        """Per-tool metrics for every registered tool"""
+        with self._lock:
+            return {name: metrics.stats() for name, metrics in self._metrics.items()}
+
+
+# Shared registry populated by agent.py
+tool_registry = ToolRegistry()